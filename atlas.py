@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import pygame
+
+CACHEDIRECTORY = "./cache/"
+PAGESIZE = 2048
+
+class Atlas():
+    """A group of sprite directories scaled to one size and packed into a few
+    large page surfaces. index maps each directory and sprite name to the
+    page and rect it was packed into, and the sprites handed out are
+    subsurfaces of the pages. Pages are cached on disk per size, so later
+    runs load one image per page instead of scaling every sprite again.
+
+    A subsurface shares its pixels with its page, so drawing onto, filling
+    or otherwise editing an atlas sprite changes every other sprite on that
+    page and every copy handed out later. They are read-only: copy() one
+    before drawing onto it.
+    """
+    def __init__(self, name, directories, size):
+        self.name = name
+        self.directories = directories
+        self.size = size
+        self.pages = []
+        self.index = {}
+        self.path = "%satlas-%s-%dx%d" % (CACHEDIRECTORY, name, size[0], size[1])
+
+    def fingerprint(self) -> "String":
+        """Hash of the name, size and modification time of every source file,
+        used to tell whether the cached pages are still up to date.
+        """
+        files = []
+        for directory in self.directories:
+            for spritename in sorted(os.listdir(directory)):
+                stat = os.stat(directory + spritename)
+                files.append([directory, spritename, stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps([self.size, files]).encode()).hexdigest()
+
+    def build(self, spritecache):
+        """Scales every sprite in the directories and packs them into pages.
+        All sprites share one size, so each page is a plain grid.
+        """
+        width, height = self.size
+        columns = max(1, PAGESIZE // width)
+        rows = max(1, PAGESIZE // height)
+        sprites = []
+        for directory in self.directories:
+            for key, sprite in sorted(spritecache.load_directory(directory).items()):
+                sprites.append((directory, key, sprite))
+        self.pages = []
+        self.index = {}
+        perpage = columns * rows
+        for start in range(0, len(sprites), perpage):
+            batch = sprites[start:start + perpage]
+            pagerows = -(-len(batch) // columns)
+            page = pygame.Surface((min(len(batch), columns) * width, pagerows * height), pygame.SRCALPHA).convert_alpha()
+            for number, (directory, key, sprite) in enumerate(batch):
+                rect = (number % columns * width, number // columns * height, width, height)
+                page.blit(pygame.transform.scale(sprite, self.size), rect[:2])
+                self.index.setdefault(directory, {})[key] = (len(self.pages), rect)
+            self.pages.append(page)
+
+    def load(self) -> "Boolean":
+        """Loads the pages cached on disk, returning False if there are none
+        or they were built from different source files.
+        """
+        try:
+            with open(self.path + ".json") as file:
+                data = json.load(file)
+            if data["fingerprint"] != self.fingerprint():
+                return False
+            pages = [pygame.image.load("%s-%d.png" % (self.path, number)).convert_alpha() for number in range(data["pages"])]
+        except (OSError, ValueError, KeyError, pygame.error):
+            return False
+        self.pages = pages
+        self.index = {directory: {key: (page, tuple(rect)) for key, (page, rect) in sprites.items()} for directory, sprites in data["index"].items()}
+        return True
+
+    def save(self):
+        """Writes the pages and index to the cache directory. Failing to
+        write is not an error, the atlas is just built again next run.
+        """
+        try:
+            os.makedirs(CACHEDIRECTORY, exist_ok=True)
+            for number, page in enumerate(self.pages):
+                pygame.image.save(page, "%s-%d.png" % (self.path, number))
+            with open(self.path + ".json", "w") as file:
+                json.dump({"fingerprint": self.fingerprint(), "pages": len(self.pages), "index": self.index}, file)
+        except (OSError, pygame.error):
+            pass
+
+    def directory(self, directory) -> "Dictionary":
+        """Returns a dictionary of the sprites from one directory as
+        subsurfaces of the pages, keyed like make_dict(). The sprites are
+        read-only views of the shared pages, see Atlas.
+        """
+        return {key: self.pages[page].subsurface(rect) for key, (page, rect) in self.index.get(directory, {}).items()}
@@ -4,63 +4,68 @@ import utils
 import random
 pg.init()
 
-SPRITES = { # misc sprites
-    "Void": pg.image.load("sprites/Void.png")
-}
+# sprites are loaded through utils.spritecache the first time a tile needs them
+VOIDSPRITE = "sprites/Void.png"
 # full tile sprites
-grassdict = utils.make_dict("./sprites/Grass/")
-grass_extras_dict = utils.make_dict("./sprites/misc/grassdeco/")
-walldict = utils.make_dict("./sprites/Wall/")
+GRASSSPRITES = "./sprites/Grass/"
+GRASSDECORATIONS = "./sprites/misc/grassdeco/"
+WALLSPRITES = "./sprites/Wall/"
+
+# (x, y) offsets of the neighbours in the order of the autotile digits
+NEIGHBOURS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+def sprite_variant(mask) -> "Integer":
+    """Maps a neighbour mask to the variant with a sprite. A corner only
+    counts as the same tile when both edges next to it do, so a missing
+    edge marks its corners as different too.
+    """
+    digits = [mask >> (7 - bit) & 1 for bit in range(8)]
+    for edge, corners in [(1, (0, 2)), (4, (2, 7)), (3, (0, 5)), (6, (5, 7))]:
+        if digits[edge]:
+            for corner in corners:
+                digits[corner] = 1
+    return sum(digit << (7 - bit) for bit, digit in enumerate(digits))
+
+VARIANTLOOKUP = bytes(sprite_variant(mask) for mask in range(256))
 
 class Block():
-    """Any tile that inherits from this class will have a choose_sprite method"""
-    def choose_sprite(self, position, layout, size):
+    """Any tile that inherits from this class will have a choose_variant method.
+    Tiles are shared by every cell of their type, so per cell choices are
+    returned to the level to store instead of being kept on the tile.
+    """
+    def choose_variant(self, position, layout) -> "Integer":
         """
         0  |  1  |  2  - An 8 binary digit string is stored to denote whether or not a particular 
         3  | pos |  4  - index is occupied by a tile of the same type as the centre tile
         5  |  6  |  7  - 1 is a different tile and 0 is a tile of the same type/style.
+        The digits are packed into one integer, digit 0 being the highest bit,
+        and mapped to the sprite variant through VARIANTLOOKUP.
         """
-        info = [1,1,1,1,1,1,1,1]
-        for y in [-1, 0, 1]:
-            for x in [-1, 0, 1]:
-                blocky = position[1] + y
-                blockx = position[0] + x
-                if len(layout[0]) >blockx > -1 and len(layout) > blocky > -1:
-                    if layout[blocky][blockx].group == self.group:
-                        if y == -1 and x == -1:
-                            info[0] = 0
-                        elif y == -1 and x == 0:
-                            info[1] = 0
-                        elif y == -1 and x == 1:
-                            info[2] = 0
-                        elif y == 0 and x == -1:
-                            info[3] = 0
-                        elif y == 0 and x == 1:
-                            info[4] = 0
-                        elif y == 1 and x == -1:
-                            info[5] = 0
-                        elif y == 1 and x == 0:
-                            info[6] = 0
-                        elif y == 1 and x == 1:
-                            info[7] = 0
-        id = info.copy()
-        if info[1] == 1:
-            id[0] = 1
-            id[2] = 1
-        if info[4] == 1:
-            id[2] = 1
-            id[7] = 1
-        if info[3] == 1:
-            id[0] = 1
-            id[5] = 1
-        if info[6] == 1:
-            id[5] = 1
-            id[7] = 1
-        self.sprite = pg.transform.scale(self.spritedict[str(id).strip("[]").replace(", ", "")], (size, size))
-        self.do_additional_generation(position, layout, size)
+        mask = 0
+        for bit, (x, y) in enumerate(NEIGHBOURS):
+            blocky = position[1] + y
+            blockx = position[0] + x
+            if not (len(layout[0]) > blockx > -1 and len(layout) > blocky > -1) or layout[blocky][blockx].group != self.group:
+                mask |= 128 >> bit
+        return VARIANTLOOKUP[mask]
 
-    def do_additional_generation(self, position, layout, size):
-        return
+    def variant_sprite(self, variant, size) -> "Surface":
+        """Returns the shared sprite for a variant from choose_variant(), or
+        the base "00000000" sprite if there is no image for that variant.
+        """
+        sprites = utils.spritecache.scaled_directory(self.spritedirectory, size)
+        return sprites.get(format(variant, "08b"), sprites["00000000"])
+
+    def choose_decoration(self, rng=random):
+        """Returns None, or an (index, offsetx, offsety) tuple describing a
+        decoration from decoration_sprites() to draw over the tile, rolled
+        with rng, which defaults to the random module.
+        """
+        return None
+
+def decoration_sprites() -> "List":
+    """Decorations in the order choose_decoration() indexes them."""
+    return list(utils.spritecache.load_directory(GRASSDECORATIONS).values())
 
 class Void():
     """Solid texture used for filling empty space on the screen,
@@ -70,7 +75,7 @@ class Void():
         self.weight = weight
         self.transparent = True
         self.light = 0
-        self.sprite = pg.transform.scale(SPRITES["Void"], (size, size))
+        self.sprite = utils.spritecache.scaled(VOIDSPRITE, size)
         self.luminous = False
 
 class Grass(Block):
@@ -81,18 +86,20 @@ class Grass(Block):
         self.weight = 1
         self.transparent = True
         self.group = "Grass"
-        self.spritedict = grassdict
-        self.sprite = pg.transform.scale(grassdict["00000000"], (size, size))
+        self.spritedirectory = GRASSSPRITES
+        self.sprite = utils.spritecache.scaled_directory(self.spritedirectory, size)["00000000"]
         self.light = 255
         self.luminous = True
 
-    def do_additional_generation(self, position, layout, size):
-        if random.randint(1, 4) == 1:
-            offset1 = random.randint(-5, 5)
-            offset2 = random.randint(-5, 5)
-            location = (self.sprite.get_width() + offset1, self.sprite.get_height() + offset2)
-            blittable = random.choice(list(grass_extras_dict.values()))
-            self.sprite.blit(blittable, location)
+    def choose_decoration(self, rng=random):
+        if rng.randint(1, 4) == 1:
+            offset1 = rng.randint(-5, 5)
+            offset2 = rng.randint(-5, 5)
+            return (rng.randrange(len(decoration_sprites())), offset1, offset2)
+        return None
+
+    def decoration_location(self, blittable, offset, size) -> "Tuple":
+        return (size + offset[0], size + offset[1])
 
 class Wall(Block):
     """Default values: solid=True, transparent=False.
@@ -102,10 +109,10 @@ class Wall(Block):
         self.weight = weight
         self.transparent = transparent
         self.group = "Wall"
-        self.spritedict = walldict
+        self.spritedirectory = WALLSPRITES
         self.light = 0
         self.luminous = False
-        self.sprite = pg.transform.scale(walldict["00000000"], (size, size))
+        self.sprite = utils.spritecache.scaled_directory(self.spritedirectory, size)["00000000"]
 
 class DarkGrass(Block):
     """Identical as normal grass, but emits no light."""
@@ -114,14 +121,16 @@ class DarkGrass(Block):
         self.transparent = True
         self.light = 0
         self.luminous = False
-        self.spritedict = grassdict
-        self.sprite = pg.transform.scale(grassdict["00000000"], (size, size))
+        self.spritedirectory = GRASSSPRITES
+        self.sprite = utils.spritecache.scaled_directory(self.spritedirectory, size)["00000000"]
         self.group = "Grass"
-    def do_additional_generation(self, position, layout, size):
-        if random.randint(1, 4) == 1:
+    def choose_decoration(self, rng=random):
+        if rng.randint(1, 4) == 1:
             # todo make this variable with ppb
-            offset1 = random.randint(-20, 20)
-            offset2 = random.randint(-20, 20)
-            blittable = random.choice(list(grass_extras_dict.values()))
-            location = ((self.sprite.get_width() - blittable.get_width()) / 2 + offset1, (self.sprite.get_height() - blittable.get_height()) / 2 + offset2)
-            self.sprite.blit(blittable, location)
\ No newline at end of file
+            offset1 = rng.randint(-20, 20)
+            offset2 = rng.randint(-20, 20)
+            return (rng.randrange(len(decoration_sprites())), offset1, offset2)
+        return None
+
+    def decoration_location(self, blittable, offset, size) -> "Tuple":
+        return ((size - blittable.get_width()) / 2 + offset[0], (size - blittable.get_height()) / 2 + offset[1])
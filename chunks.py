@@ -0,0 +1,75 @@
+"""Splits levels into square chunks of tiles that are drawn on demand
+around the player and dropped again once they are far away. Chunks of
+large, streamed levels are also lit and populated with entities on demand.
+"""
+import marshal
+import levelparser
+
+CHUNKSIZE = 16
+# levels with more cells than this are streamed chunk by chunk
+STREAMINGCELLS = 256 * 256
+
+class Chunk():
+    """A rectangle of a level's tiles, given in tiles by rect. The baked
+    surface, base lighting and decorations are filled in by LevelData the
+    first time they are needed and are dropped along with the chunk.
+    """
+    def __init__(self, x, y, rect):
+        self.x = x
+        self.y = y
+        self.rect = rect
+        self.surface = None
+        self.lighting = None
+        self.lighting_dropoff = None
+        # LevelData.version the lighting was spread for
+        self.lighting_version = None
+        self.decorations = None
+        self.decoration_offsets = None
+
+def plain(value) -> "Boolean":
+    """Checks that a value only holds numbers, strings, None and tuples or lists of those."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if isinstance(value, (tuple, list)):
+        return all(plain(item) for item in value)
+    return False
+
+def sleeps(entity) -> "Boolean":
+    """Checks that an entity can be packed, which needs its class to be
+    registered with levelparser. Other entities, like projectiles, keep
+    their chunk loaded instead, see LevelData.stream().
+    """
+    registered = levelparser.registry.get("entities", {}).get(type(entity).__name__)
+    return registered is not None and registered[0] is type(entity)
+
+def pack_spec(spec) -> "Bytes":
+    """Packs an entity spec from levelparser as an entity that has not been built yet."""
+    return marshal.dumps((spec[0], spec[1], {}))
+
+def attributes(entity) -> "Dictionary":
+    """Returns every attribute an entity has set, whether it is held in the
+    __slots__ of one of its classes or in its __dict__.
+    """
+    values = {}
+    for cls in type(entity).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if hasattr(entity, name):
+                values[name] = getattr(entity, name)
+    values.update(getattr(entity, "__dict__", {}))
+    return values
+
+def pack_entity(entity) -> "Bytes":
+    """Packs an entity into a compact bytes object holding its class name,
+    position and every attribute that is a plain value. Sprites and other
+    objects are left out and rebuilt by the constructor when unpacked.
+    """
+    state = {key: value for key, value in attributes(entity).items() if plain(value)}
+    return marshal.dumps((type(entity).__name__, (("position", (entity.x, entity.y)),), state))
+
+def unpack_entity(data) -> "Entity":
+    """Rebuilds an entity packed by pack_entity() or pack_spec()."""
+    name, values, state = marshal.loads(data)
+    entity = levelparser.build((name, values), "entities")
+    for key, value in state.items():
+        setattr(entity, key, value)
+    return entity
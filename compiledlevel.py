@@ -0,0 +1,150 @@
+"""Compiled .lvlc level files, cached next to the sprite atlases.
+
+A compiled level is a small header followed by the parsed specs and four
+arrays of one byte per cell: tile ids, autotile variants, transparency and
+base lighting. Streamed levels are lit chunk by chunk instead, so their
+lighting array is left out. Compiled levels are memory-mapped on load and
+rebuilt whenever the source level file changes, or the fingerprint in the
+header of the code that compiled them, from leveldata.compile_fingerprint(),
+does not match.
+"""
+import marshal
+import os
+import mmap
+import struct
+import hashlib
+import threading
+import atlas
+import levelparser
+
+MAGIC = b"LVLC"
+# bumped whenever the layout of a compiled level changes
+FORMAT = 4
+# magic, format, width, height, sha1 fingerprint and the length of the spec section
+HEADER = struct.Struct("<4sHII20sI")
+ARRAYS = ["ids", "variants", "transparency", "lighting"]
+
+class CompiledLevel():
+    """Everything LevelData needs from a level file that does not depend on
+    the random decorations or the screen. lighting is the base lighting
+    spread with the given (dropoff, diagonaldropoff), or None with a
+    dropoff of None if the level is not lit up front. mapping is the mmap
+    the arrays are views of, for a level loaded from the cache.
+    """
+    def __init__(self, width, height, player, entities, items, codes, dropoff, ids, variants, transparency, lighting, mapping=None):
+        self.width = width
+        self.height = height
+        self.player = player
+        self.entities = entities
+        self.items = items
+        self.codes = codes
+        self.dropoff = dropoff
+        self.ids = ids
+        self.variants = variants
+        self.transparency = transparency
+        self.lighting = lighting
+        self.mapping = mapping
+
+    def close(self):
+        """Releases the arrays and closes the mapping, once a level has
+        copied everything it needs out of them.
+        """
+        for name in ARRAYS:
+            if isinstance(getattr(self, name), memoryview):
+                getattr(self, name).release()
+            setattr(self, name, None)
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+def cache_path(source) -> "String":
+    return atlas.CACHEDIRECTORY + os.path.basename(source) + ".lvlc"
+
+def source_hash(source) -> "String":
+    with open(source, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load(source, codes, fingerprint) -> "CompiledLevel":
+    """Returns the compiled level for a source level file, or None if there
+    is none, it is unreadable, or it was compiled from a different version
+    of the source, with different tile codes, with a different fingerprint
+    or with specs the registered classes no longer accept. The arrays are
+    handed out as memoryviews of a private copy-on-write mapping of the
+    file, so only the parts that are used are read from disk and edits
+    never reach it.
+    """
+    try:
+        with open(cache_path(source), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, width, height, compiledwith, speclength = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != FORMAT or compiledwith != fingerprint:
+            mapped.close()
+            return None
+        start = HEADER.size + speclength
+        info = marshal.loads(mapped[HEADER.size:start])
+        arraycount = len(ARRAYS) if info["dropoff"] is not None else len(ARRAYS) - 1
+        if len(mapped) != start + arraycount * width * height or info["codes"] != codes:
+            mapped.close()
+            return None
+        # an unchanged modification time and size is taken as an unchanged
+        # source, and only when either differs, such as after a fresh
+        # checkout, is the source hashed to see whether its contents changed
+        stat = os.stat(source)
+        if info["source"][:2] != [stat.st_mtime_ns, stat.st_size]:
+            if info["source"][2] != source_hash(source):
+                mapped.close()
+                return None
+        # the specs were checked when the level was compiled, but the
+        # classes they build may have changed since
+        levelparser.check_spec(info["player"], "player")
+        for entity in info["entities"]:
+            levelparser.check_spec(entity, "entities")
+        for item in info["items"]:
+            levelparser.parse_spec(item, "items")
+    except (OSError, ValueError, EOFError, KeyError, TypeError, IndexError, struct.error):
+        # LevelFormatError is a ValueError, so bad specs are a cache miss too
+        mapped.close()
+        return None
+    cells = width * height
+    arrays = [memoryview(mapped)[start + number * cells:start + (number + 1) * cells] for number in range(arraycount)]
+    if info["dropoff"] is None:
+        arrays.append(None)
+    dropoff = tuple(info["dropoff"]) if info["dropoff"] is not None else None
+    return CompiledLevel(width, height, info["player"], info["entities"], info["items"], codes, dropoff, *arrays, mapping=mapped)
+
+def save(source, compiled, fingerprint):
+    """Writes a compiled level to the cache, along with the fingerprint of
+    the code that compiled it. Failing to write is not an error, the level
+    is just compiled again the next time it is loaded.
+    """
+    stat = os.stat(source)
+    info = {
+        "source": [stat.st_mtime_ns, stat.st_size, source_hash(source)],
+        "codes": compiled.codes,
+        "dropoff": list(compiled.dropoff) if compiled.dropoff is not None else None,
+        "player": compiled.player,
+        "entities": compiled.entities,
+        "items": compiled.items,
+    }
+    specs = marshal.dumps(info)
+    path = cache_path(source)
+    # levelloader may be saving the same level on its worker thread, so
+    # every writer gets its own temporary file and the last replace wins
+    temporary = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(atlas.CACHEDIRECTORY, exist_ok=True)
+        with open(temporary, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT, compiled.width, compiled.height, fingerprint, len(specs)))
+            f.write(specs)
+            for name in ARRAYS:
+                if getattr(compiled, name) is not None:
+                    f.write(getattr(compiled, name))
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
@@ -3,34 +3,81 @@ import random
 import pygame as pg
 import math
 import utils
+import levelparser
+import pathfinding
+import visibility
 pg.init()
 
 # General Behaviour of entities:
 # Update methods should always return a list of entities that should continue to be processed for the next frame
 # Pathfinding methods will simply set the next_move attribute according to data given - movement methods still have to be called as needed.
+# The flow field passed to call_pathfind() is shared by every entity, see pathfinding.py.
 # Directions are represented using Numpad Notation to avoid string processing: North East South West = 8 6 2 4
 
 class Sprites():
-    """Simple class for storing and resizing sprites."""
+    """Simple class for storing and resizing sprites. Nothing is loaded
+    until a sprite is first asked for, so importing this module is free.
+    Every sprite handed out, tinted ones included, is shared by all the
+    entities using it and must be copied before anything is drawn onto it.
+    """
+    paths = {
+        "blank": "sprites/blank.png",
+        "teleporter": "sprites/Teleporter.png",
+        "caveman": "sprites/Caveman.png",
+    }
     def __init__(self):
-        self.sprites = {
-            "blank": pg.image.load("sprites/blank.png"),
-            "teleporter": pg.image.load("sprites/Teleporter.png"),
-            "caveman": pg.image.load("sprites/Caveman.png"),
-        }
-        # 8 different sprites, named 0.png - 7.png
-        self.fireballsprites = utils.make_dict("./sprites/fireball/")
-        self.fireballsprites["d4"] = pg.transform.rotate(self.fireballsprites["d6"], 180)
-        self.fireballsprites["d8"] = pg.transform.rotate(self.fireballsprites["d6"], 90)
-        self.fireballsprites["d2"] = pg.transform.rotate(self.fireballsprites["d6"], 270)
-        self.redtint = pg.Surface((1, 1)).convert_alpha()
-        self.redtint.fill((255, 0, 0, 200))
+        self.size = None
+        self.loaded = None
     def resize(self, ppb):
-        for key in self.sprites.keys():
-            self.sprites[key] = pg.transform.scale(self.sprites[key], (ppb, ppb))
-        for key in self.fireballsprites.keys():
-            self.fireballsprites[key] = pg.transform.scale(self.fireballsprites[key], (ppb, ppb))
-        self.redtint = pg.transform.scale(self.redtint, (ppb, ppb))
+        self.size = ppb
+        self.loaded = None
+    def load(self):
+        """Builds the sprite dictionaries for the current size."""
+        sprites = {}
+        for key in self.paths.keys():
+            if self.size is None:
+                sprites[key] = utils.spritecache.load(self.paths[key])
+            else:
+                sprites[key] = utils.spritecache.scaled(self.paths[key], self.size)
+        # 8 different sprites, named 0.png - 7.png
+        if self.size is None:
+            fireballsprites = dict(utils.spritecache.load_directory("./sprites/fireball/"))
+        else:
+            fireballsprites = dict(utils.spritecache.scaled_directory("./sprites/fireball/", self.size))
+        fireballsprites["d4"] = pg.transform.rotate(fireballsprites["d6"], 180)
+        fireballsprites["d8"] = pg.transform.rotate(fireballsprites["d6"], 90)
+        fireballsprites["d2"] = pg.transform.rotate(fireballsprites["d6"], 270)
+        redtint = pg.Surface((1, 1)).convert_alpha()
+        redtint.fill((255, 0, 0, 200))
+        if self.size is not None:
+            redtint = pg.transform.scale(redtint, (self.size, self.size))
+        self.loaded = (sprites, fireballsprites, redtint, {})
+    @property
+    def sprites(self):
+        if self.loaded is None:
+            self.load()
+        return self.loaded[0]
+    @property
+    def fireballsprites(self):
+        if self.loaded is None:
+            self.load()
+        return self.loaded[1]
+    @property
+    def redtint(self):
+        if self.loaded is None:
+            self.load()
+        return self.loaded[2]
+    def tinted(self, key) -> "Surface":
+        """Returns a sprite tinted red, made once and shared by every entity
+        using it. The surface is read-only: copy() it before drawing onto it.
+        """
+        if self.loaded is None:
+            self.load()
+        tints = self.loaded[3]
+        if key not in tints:
+            tints[key] = self.sprites[key].copy()
+            tints[key].blit(self.redtint, (0, 0), special_flags = pg.BLEND_RGBA_MULT)
+        return tints[key]
 
 
 sprites = Sprites()
@@ -38,20 +85,29 @@ sprites = Sprites()
 class Entity():
     """Base class for most entities, and should
     only be used for the purposes of inheritance.
+    Entities use __slots__ so that thousands of them stay small, and every
+    subclass lists the attributes it adds in its own __slots__.
     """
+    __slots__ = ("x", "y", "direction", "sprite", "next_move", "light", "friendly", "occupancy", "entityid")
+    # flags that are the same for every entity of a class, set by subclasses
+    luminescent = False
+    interactable = False
+    walkable = False
+    projectile = False
+    enemy = False
+    pickup = False
+
     def __init__(self, position):
         self.x = position[0]
         self.y = position[1]
-        self.luminescent = False
-        self.interactable = False
-        self.walkable = False
         self.friendly = False
-        self.projectile = False
-        self.enemy = False
-        self.pickup = False
         self.direction = 6
         self.sprite = None
         self.next_move = (self.x, self.y)
+        # the Occupancy index of the level holding the entity, if any
+        self.occupancy = None
+        # the id given by the level's EntityStore when it is spawned
+        self.entityid = None
     
     def frame_update(self):
         return [self]
@@ -60,13 +116,15 @@ class Entity():
         return [self]
     
     def process_projectile_collisions(self, layout, entlist):
+        if self.occupancy is not None:
+            entlist = self.occupancy.at((self.x, self.y))
         for entity in entlist:
             if (entity.x, entity.y) == (self.x, self.y) and entity.friendly and entity.projectile:
                 self.health -= entity.damage
                 entity.destroyed = True
 
 
-    def call_pathfind(self, layout, target, entities):
+    def call_pathfind(self, layout, target, entities, field=None):
         ...
     
     def move(self):
@@ -76,6 +134,13 @@ class Entity():
         If the next movement is more than one tile away, the entity is teleported
         without any regard for the direction in which it's facing.
         """
+        position = (self.x, self.y)
+        self.step()
+        if self.occupancy is not None and (self.x, self.y) != position:
+            self.occupancy.moved(self)
+
+    def step(self):
+        """Changes the position or direction of the entity for move()."""
         if self.next_move == (self.x, self.y):
             return
         dx = self.next_move[0] - self.x
@@ -123,26 +188,14 @@ class Entity():
         return False
 
     def has_los(self, layout, target):
-        dx = self.x - target.x
-        dy = self.y - target.y
-        if dx == 0:
-            for i in range(abs(dy)):
-                if not layout[target.y + i][target.x].transparent:
-                    return False
-            return True
-        accuracy = 400
-        dy = self.y - target.y
-        m = dy/dx
-        c = self.y - m * self.x
-        for i in range(0, abs(dx * accuracy)):
-            if dx > 0:
-                currentx = target.x + i/accuracy
-            else:
-                currentx = target.x - i/accuracy
-            currenty = currentx * m + c
-            if not layout[round(currenty)][round(currentx)].transparent:
-                return False
-        return True
+        """Checks whether nothing opaque lies between the entity and a target.
+        The target's field of view for this turn is used if it has one, such
+        as the player's, otherwise the Bresenham line between them is checked.
+        """
+        view = getattr(target, "view", None)
+        if view is not None and view.origin == (target.x, target.y):
+            return view.sees((self.x, self.y))
+        return all(layout[y][x].transparent for x, y in visibility.line((self.x, self.y), (target.x, target.y))[1:-1])
 
     def simple_pathfind(self, layout, target, entities):
         """Sets next_move to one tile closer to a given target if there is no obstruction."""
@@ -211,29 +264,41 @@ class Entity():
     def get_sprite(self):
         return sprites.sprites[self.sprite]
 
+    def sprite_key(self) -> "Tuple":
+        """Returns a key that changes exactly when get_sprite() would return a different sprite."""
+        return (self.sprite,)
+
 # True entities
 # Enemies
 
 class Caveman(Entity):
     """Simplest AI and lowest stats.
     Moves one tile closer to the player every other turn provided that
-    there is a clear line of sight.
-    Should remember where the player was when it loses line of sight.
+    there is a clear line of sight, following the flow field around walls.
+    Remembers where the player was when it loses line of sight and heads there.
     Otherwise, wanders aimlessly around its last active location."""
+    __slots__ = ("health", "damage", "actiontick", "damagetick", "lastseen")
+    luminescent = True
+    enemy = True
+
     def __init__(self, position, health=50, damage=20):
         super().__init__(position)
-        self.luminescent = True
         self.light = 50
         self.health = health
         self.damage = damage
-        self.sprite = sprites.sprites["caveman"].copy()
-        self.damagedsprite = self.sprite.copy()
-        self.damagedsprite.blit(sprites.redtint, (0,0), special_flags = pg.BLEND_RGBA_MULT)
-        self.enemy = True
+        self.sprite = "caveman"
         self.actiontick = 0
         self.damagetick = 0
-    def call_pathfind(self, layout, target, entities):
-        self.simple_pathfind(layout, target, entities)
+        # the tile the player was last seen on, until it gets there
+        self.lastseen = None
+    def call_pathfind(self, layout, target, entities, field=None):
+        position = (self.x, self.y)
+        if field is not None and self.lastseen is not None and not field.covers(position):
+            field.widen(position)
+        if field is not None and field.reaches(position):
+            self.next_move = field.next_step(position, self.occupancy)
+        else:
+            self.simple_pathfind(layout, target, entities)
 
     def frame_update(self):
         if self.damagetick > 0:
@@ -246,7 +311,17 @@ class Caveman(Entity):
             if self.ent_contact(player):
                 player.damage(self.damage)
             elif self.has_los(layout, player):
-                self.move()
+                self.lastseen = (player.x, player.y)
+                if not pathfinding.occupied(self.occupancy, self.next_move):
+                    self.move()
+            elif self.lastseen is not None:
+                self.next_move = (self.x, self.y)
+                self.simple_pathfind(layout, self.lastseen, entlist)
+                # gives up once it is there or cannot get any closer
+                if self.next_move == (self.x, self.y):
+                    self.lastseen = None
+                elif not pathfinding.occupied(self.occupancy, self.next_move):
+                    self.move()
         else:
             self.actiontick = 1
 
@@ -261,21 +336,26 @@ class Caveman(Entity):
     
     def get_sprite(self):
         if self.damagetick == 0:
-            return self.sprite
+            return sprites.sprites[self.sprite]
         else:
-            return self.damagedsprite
+            return sprites.tinted(self.sprite)
+
+    def sprite_key(self) -> "Tuple":
+        return (self.sprite, self.damagetick != 0)
 
 # Projectiles
 
 class Fireball(Entity):
+    __slots__ = ("damage", "destroyed", "frame", "just_spawned")
+    luminescent = True
+    projectile = True
+    walkable = True
+
     def __init__(self, position, playerpos, friendly=True):
         super().__init__(position)
         self.damage = 50
-        self.luminescent = True
         self.light = 255
         self.friendly = friendly
-        self.projectile = True
-        self.walkable = True
         self.direction = self.get_direction_facing(playerpos)
         self.destroyed = False
         self.frame = 0
@@ -310,7 +390,7 @@ class Fireball(Entity):
         self.move()
         return [self]
     
-    def call_pathfind(self, layout, target, entities):
+    def call_pathfind(self, layout, target, entities, field=None):
         self.directional_pathfind(layout)
     
     def get_sprite(self):
@@ -318,6 +398,11 @@ class Fireball(Entity):
             return sprites.fireballsprites[str(self.frame // 4)]
         return sprites.fireballsprites["d" + str(self.direction)]
 
+    def sprite_key(self) -> "Tuple":
+        if self.destroyed:
+            return ("fireball", str(self.frame // 4))
+        return ("fireball", "d" + str(self.direction))
+
 # Gameplay entities
 
 class Teleporter(Entity):
@@ -327,10 +412,12 @@ class Teleporter(Entity):
     Pass a tuple for position, as well as a destination variable with the name of
     the next level. By default, the teleporter places the game in a "win" state.
     """
+    __slots__ = ("brighter", "destination", "interacted")
+    interactable = True
+    luminescent = True
+
     def __init__(self, position, destination="LEVELCLEAR"):
         super().__init__(position)
-        self.interactable = True
-        self.luminescent = True
         self.light = 50
         self.brighter = True
         self.destination = destination
@@ -352,3 +439,5 @@ class Teleporter(Entity):
                 self.brighter = False
         return [self]
 
+levelparser.register("entities", Caveman, position=levelparser.POSITION, health=int, damage=int)
+levelparser.register("entities", Teleporter, position=levelparser.POSITION, destination=str)
@@ -0,0 +1,78 @@
+"""Holds the entities of a level, see EntityStore."""
+
+# entity attributes that are indexed, and never change once an entity is built
+FLAGS = ["luminescent", "interactable", "enemy", "projectile"]
+
+class EntityStore():
+    """The entities of a level, kept in a dictionary by a stable id given
+    to each entity when it is spawned, so spawning and despawning are O(1)
+    and entities are always visited in the order they were spawned.
+    Entities are also indexed by class and by each of FLAGS, and added to
+    and removed from the level's Occupancy index with the store.
+
+    Despawning is deferred until flush(), so an entity removed during an
+    update pass can still be found by the others until the pass is over.
+    """
+    def __init__(self, occupancy):
+        self.occupancy = occupancy
+        self.entities = {}
+        self.nextid = 0
+        self.flags = {flag: {} for flag in FLAGS}
+        self.types = {}
+        self.despawned = []
+
+    def __iter__(self):
+        return iter(self.entities.values())
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __contains__(self, entity):
+        return self.entities.get(entity.entityid) is entity
+
+    def spawn(self, entity) -> "Integer":
+        """Adds an entity, returning the id it is given."""
+        entity.entityid = self.nextid
+        self.nextid += 1
+        self.entities[entity.entityid] = entity
+        for flag in FLAGS:
+            if getattr(entity, flag):
+                self.flags[flag][entity.entityid] = entity
+        self.types.setdefault(type(entity), {})[entity.entityid] = entity
+        self.occupancy.add(entity)
+        return entity.entityid
+
+    def despawn(self, entity):
+        """Removes an entity at the next flush()."""
+        self.despawned.append(entity)
+
+    def flush(self):
+        """Removes every entity despawned since the last flush."""
+        for entity in self.despawned:
+            if entity not in self:
+                continue
+            del self.entities[entity.entityid]
+            for flag in FLAGS:
+                self.flags[flag].pop(entity.entityid, None)
+            del self.types[type(entity)][entity.entityid]
+            self.occupancy.remove(entity)
+        self.despawned = []
+
+    def settle(self, entity, results):
+        """Applies the list of entities returned by one entity's update
+        method: the entity is despawned if it is not in the list, and any
+        new entities in it are spawned.
+        """
+        if not any(result is entity for result in results):
+            self.despawn(entity)
+        for result in results:
+            if result not in self:
+                self.spawn(result)
+
+    def with_flag(self, flag) -> "List":
+        """Returns the entities with one of FLAGS set, such as "luminescent"."""
+        return list(self.flags[flag].values())
+
+    def of_type(self, cls) -> "List":
+        """Returns the entities of exactly one class."""
+        return list(self.types.get(cls, {}).values())
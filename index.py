@@ -1,11 +1,20 @@
 """Main script. Run to play game."""
 import time as timelibrary
+LAUNCHTIME = timelibrary.time()
 import pygame as pg
 import menu
 import leveldata
+import levelloader
 import blocks
 import entities
+import pathfinding
+import visibility
 import shader
+import utils
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 pg.mixer.pre_init(44100, -16, 4, 512)
 pg.init()
@@ -35,9 +44,10 @@ print(INFO)
 class Globals():
     """Class to contain various constants, assets and objects needed by many classes.
     The whole class can be passed to modules so that they can use rendering constants and
-    render on the main game screen.
+    render on the main game screen. The display and fonts are only created
+    by setup(), once a Game is started, so importing this module opens nothing.
     """
-    screen = pg.display.set_mode((600, 600))
+    screen = None
     ppb = 64
     entities.sprites.resize(ppb)
     tilesx = 21
@@ -45,52 +55,75 @@ class Globals():
     resolutionx = ppb * tilesx
     resolutiony = ppb * tilesy
 
-    textfont_40p = pg.font.Font("-font.ttf", 40)
-    textfont_30p = pg.font.Font("-font.ttf", 30)
-    textfont_20p = pg.font.Font("-font.ttf", 20)
-
-    darktexture = pg.Surface((ppb, ppb))
-    darktexture.fill((0, 0, 0))
-    darktexturesmall = pg.transform.scale(darktexture, (21, 21))
-    darktexturelong = pg.transform.scale(darktexture, (22, 21))
-    darktexturetall = pg.transform.scale(darktexture, (21, 22))
-    darktexturebig = pg.transform.scale(darktexture, (22, 22))
-    darktexturedict = {}
-    darktexturesmalldict = {}
-    darktexturelongdict = {}
-    darktexturetalldict = {}
-    darktexturebigdict = {}
-
-    for i in range(256):
-        darktexture.set_alpha(i)
-        darktexturesmall.set_alpha(i)
-        darktexturelong.set_alpha(i)
-        darktexturetall.set_alpha(i)
-        darktexturebig.set_alpha(i)
-        darktexturedict[i] = darktexture.copy()
-        darktexturesmalldict[i] = darktexturesmall.copy()
-        darktexturelongdict[i] = darktexturelong.copy()
-        darktexturetalldict[i] = darktexturetall.copy()
-        darktexturebigdict[i] = darktexturebig.copy()
+    @classmethod
+    def setup(cls):
+        """Opens the display and loads the fonts the menu needs for its first frame."""
+        cls.screen = pg.display.set_mode((600, 600))
+        cls.textfont_40p = pg.font.Font("-font.ttf", 40)
+        cls.textfont_30p = pg.font.Font("-font.ttf", 30)
+        cls.textfont_20p = pg.font.Font("-font.ttf", 20)
+        cls.darktexture = pg.Surface((cls.ppb, cls.ppb))
+        cls.darktexture.fill((0, 0, 0))
 
 class Game():
     """Main class required for the game. Initialize to start the game.
     Call .process() to begin the main game loop."""
     def __init__(self):
         """Instantiate game before starting."""
+        Globals.setup()
         self.tick = 1
         self.shader = shader.Shader()
+        # one pixel per visible tile (or sub-tile when upscaling), scaled up
+        # over the screen in a single blit. Overlays have a one tile border
+        # so the camera can scroll by up to a tile in any direction.
+        self.shadow_overlay = pg.Surface((Globals.tilesx + 2, Globals.tilesy + 2), pg.SRCALPHA)
+        factor = self.shader.upscale_factor
+        self.upscaled_overlay = pg.Surface(((Globals.tilesx + 2) * factor, (Globals.tilesy + 2) * factor), pg.SRCALPHA)
+        self.shadow_screen = pg.Surface(((Globals.tilesx + 2) * Globals.ppb, (Globals.tilesy + 2) * Globals.ppb), pg.SRCALPHA)
         self.maxtick = 60
         self.menu = menu.Menu(Globals)
         self.state = "start"
-        self.defaulttexture = blocks.Void(Globals.ppb)
+        # built on first use so that nothing is loaded before the menu appears
+        self.void_layer = None
+        self.preloader = self.preload()
+        self.startup_time = None
+        # pixels the camera still lags behind the player after a move,
+        # eased back to zero over scroll_frames frames
+        self.camera_shift = [0, 0]
+        self.scroll_frames = 6
         self.running = True
         self.to_reload = None
+        # prepares the levels teleporters lead to while the current one is played
+        self.levelloader = levelloader.LevelLoader(Globals)
         self.action_timer = 0
         self.fpstime = 0
+        # with dirty rendering only the parts of the screen that changed since
+        # the last frame are pushed to the display, and idle frames are skipped
+        self.dirty_rendering = True
+        self.last_frame_state = None
         pg.display.set_icon(pg.image.load("-icon.png"))
         pg.display.set_caption("Dungeon Crawler")
 
+    def preload(self):
+        """Generator that warms the sprite cache with everything a level needs,
+        one batch per step. The menu advances it between frames, so sprites
+        are loaded while the player is choosing a level instead of at startup.
+        """
+        for directory in [blocks.GRASSSPRITES, blocks.WALLSPRITES, "./sprites/player/", "./sprites/arrows/"]:
+            utils.spritecache.scaled_directory(directory, Globals.ppb)
+            yield
+        utils.spritecache.load_directory(blocks.GRASSDECORATIONS)
+        utils.spritecache.scaled(blocks.VOIDSPRITE, Globals.ppb)
+        yield
+        entities.sprites.load()
+        yield
+
+    def record_startup(self):
+        """Called by the menu once its first frame is on screen, to keep the
+        seconds from launch to that frame in startup_time.
+        """
+        self.startup_time = timelibrary.time() - LAUNCHTIME
+
     def process(self):
         """Main processing loop for the game.
         While loop is contained within.
@@ -107,6 +140,7 @@ class Game():
                 # and returns the name of the level chosen.
                 level_selection = self.menu.process(self)
                 self.level = leveldata.LevelData(level_selection, Globals)
+                self.levelloader.scan(self.level)
                 self.shader.set_dimensions(self.level)
                 self.player = self.level.player
                 self.state = "gameplay"
@@ -145,18 +179,18 @@ class Game():
                             else:
                                 self.player.down(self.level)
                         elif event.key == pg.K_e and not self.player.inventory.open:
-                            for entity in self.level.entities:
-                                if entity.interactable and (entity.x, entity.y) == tuple(self.player.facing_tile):
+                            for entity in self.level.occupancy.at(self.player.facing_tile):
+                                if entity.interactable:
                                     entity.interacted = True
                             self.player.interacted = True
                             self.player.turn = False
                         elif event.key == pg.K_f and not self.player.inventory.open:
-                            self.level.entities.append(entities.Fireball(self.player.facing_tile, (self.player.x, self.player.y), friendly=True))
+                            self.level.entities.spawn(entities.Fireball(self.player.facing_tile, (self.player.x, self.player.y), friendly=True))
                             self.player.turn = False
                         elif event.key == pg.K_q and not self.player.inventory.open:
                             self.player.turn = False
                             self.player.casting = True
-                            self.level.entities.append(entities.Fireball(self.player.facing_tile, (self.player.x, self.player.y)))
+                            self.level.entities.spawn(entities.Fireball(self.player.facing_tile, (self.player.x, self.player.y)))
                         elif event.key == pg.K_SPACE and not self.player.inventory.open:
                             self.player.attacked = True
                             self.player.turn = False
@@ -185,11 +219,20 @@ class Game():
                 self.frame_update()
                 if not self.player.turn:
                     if self.player.moved:
-                        ... # shift render
+                        self.start_scroll()
+                    # the player's field of view and one flow field towards them are shared by every entity this turn
+                    self.player.view = visibility.FieldOfView(self.level.transparency_map, self.level.width, self.level.height, (self.player.x, self.player.y))
+                    field = pathfinding.FlowField(self.level, (self.player.x, self.player.y))
                     for entity in self.level.entities:
-                        entity.call_pathfind(self.level.rows, (self.player.x, self.player.y), self.level.entities)
+                        entity.call_pathfind(self.level.rows, (self.player.x, self.player.y), self.level.entities, field)
                     self.update()
-                self.render()
+                self.update_camera()
+                # streamed every frame, so entities wake and sleep even when nothing is redrawn
+                self.level.stream(pg.Rect(self.player.x - int(Globals.tilesx / 2) - 1, self.player.y - int(Globals.tilesy / 2) - 1, Globals.tilesx + 2, Globals.tilesy + 2))
+                if self.dirty_rendering:
+                    self.render_dirty()
+                else:
+                    self.render()
 
             elif self.state == "win":
                 # Looping for victory screen
@@ -221,12 +264,13 @@ class Game():
             # print(fps)
             pg.event.pump()
 
-    def render(self):
+    def render(self, rects=None):
         """Renders all assets to the screen based on their current sprites
-        and position attributes.
+        and position attributes. If a list of rects is passed, only those
+        areas of the display are redrawn and updated instead of flipping
+        the whole screen.
         """
         # setting up variables for more comprehensible pg method calls
-        Globals.screen.fill((0, 0, 0))
         midpointx = int(Globals.tilesx / 2)
         midpointy = int(Globals.tilesy / 2)
         offsetx = self.player.x - midpointx
@@ -237,27 +281,182 @@ class Game():
         po = int(ppb * 0.05) # player offset
         facing_interactable = False
 
-        render_array = []
-        for i in range(Globals.tilesy):
-            render_array.append([])
-            for j in range(Globals.tilesx):
-                render_array[i].append(self.defaulttexture)
-                if i + offsety > -1 and j + offsetx > -1 and i + offsety < self.level.height and j + offsetx < self.level.width:
-                    render_array[i][j] = self.level.rows[i + offsety][j + offsetx]
-                Globals.screen.blit(render_array[i][j].sprite, (ppb*j, ppb*i))
-        for entity in self.level.entities:
-            if entity.x - offsetx in range(Globals.tilesx) and entity.y - offsety in range(Globals.tilesy):
-                Globals.screen.blit(entity.get_sprite(), (ppb*(entity.x - offsetx), (entity.y - offsety)*ppb))
-                if entity.interactable and (entity.x, entity.y) == tuple(self.player.facing_tile):
-                    facing_interactable = True
-        Globals.screen.blit(self.player.sprite, (midpointx*ppb, midpointy*ppb - po))
-        self.render_arrows(facing_interactable)
+        # camera position in pixels, which lags behind the player while scrolling
+        camerax = offsetx * ppb + self.camera_shift[0]
+        cameray = offsety * ppb + self.camera_shift[1]
+
+        gamearea = pg.Rect(0, 0, Globals.resolutionx, Globals.resolutiony)
+        inventory = self.player.inventory
+        inventoryarea = pg.Rect(inventory.renderposx, inventory.renderposy, inventory.width, Globals.resolutiony - inventory.renderposy)
+        uiarea = pg.Rect(0, Globals.resolutiony, Globals.resolutionx, self.player.ui.height)
+        # drawn in the order they were spawned, which is the order of their ids
+        visible = sorted(self.level.occupancy.in_rect((offsetx - 1, offsety - 1, Globals.tilesx + 2, Globals.tilesy + 2)), key=lambda entity: entity.entityid)
+        for entity in self.level.occupancy.at(self.player.facing_tile):
+            if entity.interactable:
+                facing_interactable = True
         self.render_shading(offsetx, offsety, dim, ppb)
-        if self.player.inventory.open or self.player.inventory.opening:
-            self.player.inventory.render(Globals.screen)
-        self.player.ui.render(self.player, Globals, self.player.inventory)
-        
-        pg.display.flip()
+        # every area is drawn with the screen clipped to it, so nothing
+        # outside the areas is touched
+        for area in [Globals.screen.get_rect()] if rects is None else rects:
+            Globals.screen.set_clip(area)
+            Globals.screen.fill((0, 0, 0))
+            Globals.screen.set_clip(area.clip(gamearea))
+            self.render_level(camerax, cameray)
+            for entity in visible:
+                Globals.screen.blit(entity.get_sprite(), (ppb*entity.x - camerax, ppb*entity.y - cameray))
+            Globals.screen.blit(self.player.sprite, (midpointx*ppb, midpointy*ppb - po))
+            self.render_arrows(facing_interactable)
+            Globals.screen.blit(self.shadow_screen, (-ppb - self.camera_shift[0], -ppb - self.camera_shift[1]))
+            Globals.screen.set_clip(area)
+            if (inventory.open or inventory.opening) and area.colliderect(inventoryarea):
+                inventory.render(Globals.screen)
+            if area.colliderect(uiarea) or area.colliderect(self.player.ui.baseitemsurface.get_rect()):
+                self.player.ui.render(self.player, Globals, inventory)
+        Globals.screen.set_clip(None)
+
+        if rects is None:
+            pg.display.flip()
+        else:
+            pg.display.update(rects)
+
+    def render_dirty(self):
+        """Alternative to render() that compares the state of everything drawn
+        on screen with the previous frame. Nothing is drawn if nothing changed,
+        otherwise the frame is rendered and only the changed areas are updated.
+        """
+        state = self.frame_state()
+        rects = self.dirty_rects(self.last_frame_state, state)
+        self.last_frame_state = state
+        if rects:
+            self.render(rects)
+
+    def frame_state(self) -> "Dictionary":
+        """Returns a snapshot of everything that decides what render() draws,
+        grouped by the area of the screen each part affects.
+        """
+        midpointx = int(Globals.tilesx / 2)
+        midpointy = int(Globals.tilesy / 2)
+        inventory = self.player.inventory
+        facing_interactable = False
+        entitystate = {}
+        # entities and sprites are compared by their ids in the store and
+        # their sprite keys, never by id(), which is reused after collection
+        for entity in self.level.entities:
+            entitystate[entity.entityid] = (entity.x, entity.y, entity.sprite_key())
+        for entity in self.level.occupancy.at(self.player.facing_tile):
+            if entity.interactable:
+                facing_interactable = True
+        lights = {(self.player.light, self.player.x, self.player.y)}
+        for entity in self.level.entities.with_flag("luminescent"):
+            lights.add((entity.light, entity.x, entity.y))
+        cycle = round(4 * self.tick / self.maxtick)
+        slots = [inventory.upindex, inventory.downindex, inventory.leftindex, inventory.rightindex]
+        return {
+            "camera": (self.level, self.level.version, self.player.x - midpointx, self.player.y - midpointy,
+                       tuple(self.camera_shift), self.shader.upscale, self.shader.smooth),
+            "player": (self.player.facingleft, self.player.sprite_state, self.player.animation_frame, self.player.facing, cycle, facing_interactable),
+            "entities": entitystate,
+            "lights": lights,
+            "inventory": (inventory.open, inventory.opening, inventory.current_position, inventory.pointer,
+                          tuple(self.item_key(item) for item in inventory.items)),
+            "ui": (self.player.health, self.player.max_health,
+                   tuple(None if slot is None else self.item_key(inventory.items[slot]) for slot in slots)),
+        }
+
+    def item_key(self, item) -> "Tuple":
+        """Returns a key for what an inventory item's sprites show, which only changes with its durability."""
+        return (type(item).__name__, getattr(item, "durability", None))
+
+    def dirty_rects(self, old, new) -> "List of Rects":
+        """Compares two frame_state() snapshots and returns the screen
+        areas that need to be redrawn. A changed camera redraws everything.
+        """
+        if old is None or old["camera"] != new["camera"]:
+            return [Globals.screen.get_rect()]
+        ppb = Globals.ppb
+        offsetx, offsety = new["camera"][2], new["camera"][3]
+        gamearea = pg.Rect(0, 0, Globals.resolutionx, Globals.resolutiony)
+        rects = []
+        if old["player"] != new["player"]:
+            # the player and the arrows on the tiles around them
+            midpointx = int(Globals.tilesx / 2)
+            midpointy = int(Globals.tilesy / 2)
+            rects.append(pg.Rect((midpointx - 1) * ppb, (midpointy - 1) * ppb, 3 * ppb, 3 * ppb))
+        for key in old["entities"].keys() | new["entities"].keys():
+            before = old["entities"].get(key)
+            after = new["entities"].get(key)
+            if before == after:
+                continue
+            for state in (before, after):
+                if state is not None:
+                    rects.append(pg.Rect((state[0] - offsetx) * ppb, (state[1] - offsety) * ppb, ppb, ppb))
+        for light in old["lights"] ^ new["lights"]:
+            # one tile of slack covers the interpolation of upscaled lighting
+            left, top, right, bottom = self.shader.light_footprint(light)
+            rects.append(pg.Rect((left - offsetx - 1) * ppb, (top - offsety - 1) * ppb, (right - left + 2) * ppb, (bottom - top + 2) * ppb))
+        rects = [rect.clip(gamearea) for rect in rects]
+        inventory = self.player.inventory
+        if old["inventory"] != new["inventory"]:
+            rects.append(pg.Rect(inventory.renderposx, inventory.renderposy, inventory.width, Globals.resolutiony - inventory.renderposy))
+        if old["ui"] != new["ui"]:
+            rects.append(pg.Rect(0, Globals.resolutiony, Globals.resolutionx, self.player.ui.height))
+            rects.append(self.player.ui.baseitemsurface.get_rect())
+        # overlapping areas are merged, so render() never draws a pixel twice
+        merged = []
+        for rect in rects:
+            if rect.width <= 0 or rect.height <= 0:
+                continue
+            overlapping = [other for other in merged if other.colliderect(rect)]
+            while overlapping:
+                for other in overlapping:
+                    merged.remove(other)
+                    rect = rect.union(other)
+                overlapping = [other for other in merged if other.colliderect(rect)]
+            merged.append(rect)
+        return merged
+
+    def render_level(self, camerax, cameray):
+        """Subroutine for the render() method. Blits the part of the level's
+        baked tile layer under the camera, given in pixels, chunk by chunk, with
+        the Void layer underneath wherever the view runs off the edge of the level.
+        """
+        ppb = Globals.ppb
+        view = pg.Rect(camerax, cameray, Globals.resolutionx, Globals.resolutiony)
+        area = view.clip(pg.Rect(0, 0, self.level.width * ppb, self.level.height * ppb))
+        if self.void_layer is None:
+            self.defaulttexture = blocks.Void(ppb)
+            self.void_layer = pg.Surface((Globals.resolutionx + ppb, Globals.resolutiony + ppb))
+            for i in range(Globals.tilesy + 1):
+                for j in range(Globals.tilesx + 1):
+                    self.void_layer.blit(self.defaulttexture.sprite, (ppb * j, ppb * i))
+        if area != view:
+            Globals.screen.blit(self.void_layer, (-(camerax % ppb), -(cameray % ppb)))
+        # only the chunks under the clip of the area being redrawn are needed
+        area = area.clip(Globals.screen.get_clip().move(camerax, cameray))
+        if area.width > 0 and area.height > 0:
+            # the baked layer is split into chunks of chunks.CHUNKSIZE tiles
+            for surface, rect in self.level.chunk_surfaces(area):
+                part = area.clip(rect)
+                Globals.screen.blit(surface, (part.x - view.x, part.y - view.y), part.move(-rect.x, -rect.y))
+
+    def start_scroll(self):
+        """Called when the player steps onto a new tile. The camera keeps
+        its old position for now and update_camera() eases it onto the player.
+        """
+        directions = {4: (-1, 0), 6: (1, 0), 8: (0, -1), 2: (0, 1)}
+        dx, dy = directions[self.player.facing]
+        limit = Globals.ppb
+        self.camera_shift[0] = max(-limit, min(limit, self.camera_shift[0] - dx * Globals.ppb))
+        self.camera_shift[1] = max(-limit, min(limit, self.camera_shift[1] - dy * Globals.ppb))
+
+    def update_camera(self):
+        """Moves the camera a step closer to the player every frame."""
+        step = -(-Globals.ppb // self.scroll_frames)
+        for axis in range(2):
+            if self.camera_shift[axis] > 0:
+                self.camera_shift[axis] = max(0, self.camera_shift[axis] - step)
+            elif self.camera_shift[axis] < 0:
+                self.camera_shift[axis] = min(0, self.camera_shift[axis] + step)
 
     def render_arrows(self, facing_interactable):
         """Subroutine for the render() method. Overlays arrows dependent on
@@ -288,44 +487,43 @@ class Game():
         Globals.screen.blit(sp[spritecode], location)
 
     def render_shading(self, offsetx, offsety, dim, ppb):
-        """Subroutine for the render() method. Gets a shadow map from
-        shader.py and draws it on the screen. Upscaling is currently not
-        working as intended, but can be tested by setting self.shader.upscale
-        to True. If upscaling is enabled, the routine will enlarge the shadow map
-        and use bilinear interpolation to smoothen the lighting."""
-        if self.shader.upscale == True:
-            offsetx *= 3
-            offsety *= 3
-            resolution = 3
-            ppb = int(Globals.ppb /3)
-        else:
-            resolution = 1
+        """Subroutine for the render() method. Gets a shadow map of the
+        visible window from shader.py, writes it into the alpha channel of
+        a small overlay with one pixel per tile and scales that overlay into
+        shadow_screen, which render() blits over each area it draws. If self.shader.upscale is set (the default when numpy
+        is available) the map is upscaled with bilinear interpolation first,
+        so the overlay has one pixel per sub-tile and the lighting is soft.
+        If self.shader.smooth is set the overlay is scaled with bilinear
+        filtering, which softens the edges between tiles or sub-tiles.
+        """
         lightlist = []
         lightlist.append([self.player.light, self.player.x, self.player.y])
-        for entity in self.level.entities:
-            if entity.luminescent:
-                lightlist.append([entity.light, entity.x, entity.y])
-        array = self.shader.generate_shadow_array(lightlist)
-        render_array = []
-        for i in range(Globals.tilesy * resolution):
-            render_array.append([])
-            for j in range(Globals.tilesx * resolution):
-                render_array[i].append(0)
-                if i + offsety > -1 and j + offsetx > -1 and i + offsety < len(array) and j + offsetx < len(array[0]):
-                    render_array[i][j] = array[i + offsety][j + offsetx]
-                if render_array[i][j] != None and render_array[i][j] < 255:
-                    if self.shader.upscale:
-                        if i % 3 == 0 == j % 3:
-                            Globals.screen.blit(Globals.darktexturebigdict[255 - render_array[i][j]], (ppb*j, ppb*i))
-                        elif i % 3 == 0:
-                            Globals.screen.blit(Globals.darktexturetalldict[255 - render_array[i][j]], (ppb*j, ppb*i))
-                        elif j % 3 == 0:
-                            Globals.screen.blit(Globals.darktexturelongdict[255 - render_array[i][j]], (ppb*j, ppb*i))
-                        else:
-                            Globals.screen.blit(Globals.darktexturesmalldict[255 - render_array[i][j]], (ppb*j, ppb*i))
-                    else:
-                        Globals.screen.blit(Globals.darktexturedict[255 - render_array[i][j]], (round(ppb*j), round(ppb*i)))
+        for entity in self.level.entities.with_flag("luminescent"):
+            lightlist.append([entity.light, entity.x, entity.y])
+        # a one tile border is lit so that scrolling never uncovers an unlit
+        # edge and the interpolation blends across the screen edges
+        array = self.shader.generate_shadow_array(lightlist, (offsetx - 1, offsety - 1, Globals.tilesx + 2, Globals.tilesy + 2))
+        if self.shader.upscale:
+            array = self.shader.upscale_array(array)
+            overlay = self.upscaled_overlay
+        else:
+            overlay = self.shadow_overlay
+        if np is not None:
+            alpha = pg.surfarray.pixels_alpha(overlay)
+            # surfarray indexes pixels as [x][y], so the shadow map is transposed
+            alpha[...] = 255 - np.minimum(np.asarray(array), 255).T
+            del alpha
+        else:
+            for i in range(Globals.tilesy + 2):
+                for j in range(Globals.tilesx + 2):
+                    overlay.set_at((j, i), (0, 0, 0, 255 - min(array[i][j], 255)))
+        size = self.shadow_screen.get_size()
+        if self.shader.smooth:
+            pg.transform.smoothscale(overlay, size, self.shadow_screen)
+        else:
+            pg.transform.scale(overlay, size, self.shadow_screen)
         # self.debug(array)
+
     def debug(self, array):
         """Not part of the game, but could be converted to a method to render a minimap.
         Currently displays a representation of a shadowmap array on an arbitrary location
@@ -352,17 +550,16 @@ class Game():
         This list should include the entity called, otherwise they are removed
         from the level.
         """
-        temp_entities = []
-        for i in range(len(self.level.entities)):
-            temp_entities = self.level.entities[i].update(self.level.rows, self.player, Globals, self.level.entities) + temp_entities
-        for entity in temp_entities:
-            if entity.__class__.__name__ == "Teleporter":
-                if entity.interacted is True:
-                    if entity.destination == "LEVELCLEAR":
-                        self.state = "win"
-                        return
-                    self.to_reload = entity.destination
-        self.level.entities = temp_entities
+        store = self.level.entities
+        for entity in list(store):
+            store.settle(entity, entity.update(self.level.rows, self.player, Globals, store))
+        store.flush()
+        for entity in store.of_type(entities.Teleporter):
+            if entity.interacted is True:
+                if entity.destination == "LEVELCLEAR":
+                    self.state = "win"
+                    return
+                self.to_reload = entity.destination
         self.player.update(self)
     
     def frame_update(self):
@@ -372,10 +569,10 @@ class Game():
         should not be rendered anymore (i.e. projectiles that are fading out),
         and to call entities to update their sprites if they are animated.
         """
-        temp_entities = []
-        for i in range(len(self.level.entities)):
-            temp_entities = self.level.entities[i].frame_update() + temp_entities
-        self.level.entities = temp_entities
+        store = self.level.entities
+        for entity in list(store):
+            store.settle(entity, entity.frame_update())
+        store.flush()
         self.player.frame_update(self)
         self.player.inventory.frame_update()
     
@@ -383,13 +580,15 @@ class Game():
         """Loads a game.to_reload but retains the player
         object, only changing their position attributes.
         """
-        self.level = leveldata.LevelData(self.to_reload, Globals)
+        self.level = leveldata.LevelData(self.to_reload, Globals, self.levelloader.take(self.to_reload))
+        self.levelloader.scan(self.level)
         xdiff = self.player.x - self.level.player.x
         ydiff = self.player.y - self.level.player.y
         self.player.facing_tile = [self.player.facing_tile[0] - xdiff, self.player.facing_tile[1] - ydiff]
         self.player.x = self.level.player.x
         self.player.y = self.level.player.y
         self.to_reload = None
+        self.camera_shift = [0, 0]
         self.shader.set_dimensions(self.level)
 
     def winscreen(self):
@@ -415,7 +614,9 @@ game = Game()
 try:
     game.process()
 except SystemExit:
+    game.levelloader.close()
     pg.quit()
     input()
+game.levelloader.close()
 
 
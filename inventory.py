@@ -1,19 +1,14 @@
 """File to hold the player inventory class."""
 import pygame as pg
 import utils
+import levelparser
 
-spritedict = utils.make_dict("./sprites/inventory/")
+# filled with item sprites scaled to the box size by Inventory.generate_sprite()
+spritedict = {}
 # subsurface = a_surface.subsurface((x, y, width, height))
 class Inventory():
     """Child of the player class, to be initialized with the
     players itself and items to add by default."""
-    basesprite = pg.Surface((1, 1)).convert_alpha()
-    lightcolour = pg.Surface((1, 1)).convert_alpha()
-    darkcolour = pg.Surface((1, 1)).convert_alpha()
-    basesprite.fill((35, 35, 35))
-    lightcolour.fill((37, 39, 39))
-    darkcolour.fill((28, 28, 28))
-    boxsprite = pg.image.load("./sprites/inventory/box.png")
     def __init__(self, player):
         """Initializes inventory pointers and attributes.
         generate_sprite() should be called separately before
@@ -46,16 +41,21 @@ class Inventory():
         self.contour_width = int(self.height * 0.025)
         contour_width = self.contour_width
         self.usable_dimensions = (self.width - contour_width * 2, self.height - contour_width * 2)
-        cornerpiece = pg.image.load("./sprites/inventory/corner.png").convert_alpha()
-        cornerpiece = pg.transform.scale(cornerpiece, (contour_width, contour_width))
+        basesprite = pg.Surface((1, 1)).convert_alpha()
+        lightcolour = pg.Surface((1, 1)).convert_alpha()
+        darkcolour = pg.Surface((1, 1)).convert_alpha()
+        basesprite.fill((35, 35, 35))
+        lightcolour.fill((37, 39, 39))
+        darkcolour.fill((28, 28, 28))
+        cornerpiece = utils.spritecache.scaled("./sprites/inventory/corner.png", (contour_width, contour_width))
 
-        self.sprite = pg.transform.scale(self.basesprite, (self.width, self.height))
+        self.sprite = pg.transform.scale(basesprite, (self.width, self.height))
         self.sprite.blit(cornerpiece, (0, 0))
         self.sprite.blit(cornerpiece, (self.width - contour_width, self.height - contour_width))
-        self.sprite.blit(pg.transform.scale(self.darkcolour, (contour_width, self.height - contour_width)), (0, contour_width))
-        self.sprite.blit(pg.transform.scale(self.lightcolour, (self.width - contour_width, contour_width)), (contour_width, 0))
-        self.sprite.blit(pg.transform.scale(self.darkcolour, (self.width - 2*contour_width, contour_width)), (contour_width, self.height - contour_width))
-        self.sprite.blit(pg.transform.scale(self.lightcolour, (contour_width, self.height - 2 * contour_width)), (self.width - contour_width, contour_width))
+        self.sprite.blit(pg.transform.scale(darkcolour, (contour_width, self.height - contour_width)), (0, contour_width))
+        self.sprite.blit(pg.transform.scale(lightcolour, (self.width - contour_width, contour_width)), (contour_width, 0))
+        self.sprite.blit(pg.transform.scale(darkcolour, (self.width - 2*contour_width, contour_width)), (contour_width, self.height - contour_width))
+        self.sprite.blit(pg.transform.scale(lightcolour, (contour_width, self.height - 2 * contour_width)), (self.width - contour_width, contour_width))
         self.sprite.convert_alpha()
 
         headertext = assets.textfont_40p.render("Inventory", True, (255, 255, 255))
@@ -64,9 +64,8 @@ class Inventory():
         self.sprite.blit(headertext, (right, down))
 
         self.boxspritedim = (int(self.width * 0.2), int(self.width * 0.2))
-        self.boxsprite = pg.transform.scale(self.boxsprite, self.boxspritedim).convert_alpha()
-        for key in spritedict.keys():
-            spritedict[key] = pg.transform.scale(spritedict[key], self.boxspritedim).convert_alpha()
+        self.boxsprite = utils.spritecache.scaled("./sprites/inventory/box.png", self.boxspritedim)
+        spritedict.update(utils.spritecache.scaled_directory("./sprites/inventory/", self.boxspritedim))
         
         backglow = pg.Surface((self.boxspritedim[0] - 1, self.boxspritedim[0] - 1))
         backglow.fill((255, 200, 0))
@@ -195,9 +194,9 @@ class Inventory():
     
     def add(self, item):
         """Adds one item to the inventory to be passed in the string
-        format "Item(attribute1=foo, attribute2=bar) for use of eval().
+        format "Item(attribute1=foo, attribute2=bar)", as parsed by levelparser.
         """
-        item = eval(item)
+        item = levelparser.build(levelparser.parse_spec(item, "items"), "items")
         item.generate_box(self)
         self.items.append(item)
         self.capacity += 1
@@ -265,4 +264,6 @@ class Bow(Item):
         self.sprite = spritedict["bow"]
         self.breakable = breakable
         self.durability, self.max_durability = durability, durability
-        
\ No newline at end of file
+
+for itemclass in [Longsword, Fireball, Bomb, Potion, Bow]:
+    levelparser.register("items", itemclass, breakable=bool, durability=int)
@@ -1,15 +1,29 @@
 import pygame as pg
 import blocks
 import entities
-import copy
+import levelparser
+import compiledlevel
+import chunks
+import entitystore
+import random
+import json
+import hashlib
+import shader
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from player import Player
 from userinterface import UserInterface
 
-class LevelData():
-    def __init__(self, selection, assets):
-        # todo add check_validity() to see if the data is useable
-        size = assets.ppb
-        compressiondict = {
+# tile types by ppb, shared by every level since tiles are flyweights
+tiletypecache = {}
+
+def tile_types(size) -> "Dictionary":
+    """Returns the tile object for every tile character, scaled to size."""
+    if size not in tiletypecache:
+        tiletypecache[size] = {
             "g": blocks.Grass(size), # grass
             "v": blocks.Void(size), # void
             "a": blocks.Void(size, weight=1), # air
@@ -17,78 +31,573 @@ class LevelData():
             "h": blocks.Wall(size, weight=1, transparent = True), # hidden
             "i": blocks.DarkGrass(size) # indoor
         }
+    return tiletypecache[size]
+
+def compile_fingerprint(compressiondict) -> "Bytes":
+    """Hash of everything in the code that a compiled level depends on
+    besides its source file: the attributes of each tile type, the autotile
+    lookup table, the lighting dropoff and the streaming threshold.
+    """
+    tiles = [[code, type(tile).__name__, tile.weight, tile.transparent, tile.light, tile.luminous,
+              getattr(tile, "group", None), hasattr(tile, "choose_variant")] for code, tile in compressiondict.items()]
+    lighting = shader.Shader()
+    return hashlib.sha1(json.dumps([tiles, blocks.VARIANTLOOKUP.hex(), lighting.dropoff, lighting.diagonaldropoff,
+                                    chunks.STREAMINGCELLS]).encode()).digest()
+
+def prepare(selection, compressiondict, ppb) -> "CompiledLevel":
+    """Returns the compiled form of a level, compiling and caching it first
+    if needed. Nothing here touches pygame, so levels can be prepared on a
+    worker thread, as levelloader does.
+    """
+    source = "levels/" + selection
+    fingerprint = compile_fingerprint(compressiondict)
+    # levels are compiled once and cached, so reloads skip parsing, autotiling and lighting
+    compiled = compiledlevel.load(source, "".join(compressiondict), fingerprint)
+    if compiled is None:
+        builder = LevelData.__new__(LevelData)
+        builder.name = selection
+        builder.ppb = ppb
+        compiled = builder.compile(source, compressiondict)
+        compiledlevel.save(source, compiled, fingerprint)
+        # map the saved file rather than keeping the freshly built arrays
+        compiled = compiledlevel.load(source, "".join(compressiondict), fingerprint) or compiled
+    return compiled
+
+class LevelData():
+    def __init__(self, selection, assets, compiled=None):
+        """Loads a level by name. A compiled level from prepare(), such as one
+        prepared in the background by levelloader, is used if one is passed.
+        """
+        # todo add check_validity() to see if the data is useable
+        size = assets.ppb
+        self.ppb = size
+        compressiondict = tile_types(size)
         self.name = selection
-        with open("levels/" + self.name, "r") as f:
-            filedata = f.read().split("\n")
-            level_data = filedata[0].split("|")
-            try:
-                item_data = filedata[1].split(" ")
-            except:
-                item_data = []
-        self.name = selection
-        self.entities = []
-        self.width = int(level_data[0])
-        self.height = int(level_data[1])
-        self.player = eval(level_data[2])
+        if compiled is None:
+            compiled = prepare(selection, compressiondict, size)
+        item_data = compiled.items
+        self.width = compiled.width
+        self.height = compiled.height
+        self.player = levelparser.build(compiled.player, "player")
         self.player.resize_sprites(size)
-        tilelist = self.convert_data(list(level_data[3]))
-        entitylist = level_data[4].split("/")
-        if entitylist[0] != "":
-            for entitystring in entitylist:
-                self.entities.append(eval("entities." + entitystring))
-        self.rows = []
-        iteration = 0
-        for i in range(self.height):
-            self.rows.append([])
-            for j in range(self.width):
-                self.rows[i].append(copy.copy(compressiondict[tilelist[iteration]]))
-                iteration += 1
-        self.spritepass(assets.ppb)
+        # every level is drawn chunk by chunk around the view, and large levels
+        # are streamed: their chunks are also lit and populated on demand,
+        # while tile data stays memory-mapped
+        self.streaming = self.width * self.height > chunks.STREAMINGCELLS
+        self.chunksize = chunks.CHUNKSIZE
+        self.chunks = {}
+        # entities in unloaded chunks, packed by chunks.pack_entity(), by chunk position
+        self.dormant = {}
+        # which entities are on each tile, kept up to date by Entity.move()
+        self.occupancy = Occupancy()
+        self.entities = entitystore.EntityStore(self.occupancy)
+        # levels the teleporters lead to, which levelloader can prepare ahead of time
+        self.destinations = [value for entity in compiled.entities for parameter, value in entity[1] if parameter == "destination"]
+        for entity in compiled.entities:
+            if self.streaming:
+                position = dict(entity[1]).get("position")
+                if position is None:
+                    raise levelparser.LevelFormatError("%s: %s has no position to stream it by" % (self.name, entity[0]))
+                self.dormant.setdefault(self.chunk_of(position), []).append(chunks.pack_spec(entity))
+            else:
+                self.entities.spawn(levelparser.build(entity, "entities"))
+        # base lighting for the shader, valid until the layout is edited
+        self.lighting_dropoff = compiled.dropoff
+        self.lighting_version = 0
+        if self.streaming:
+            # the views keep the mapping open for as long as the level is loaded
+            ids, variants, transparency = compiled.ids, compiled.variants, compiled.transparency
+            self.lighting = compiled.lighting
+        else:
+            ids, variants, transparency = bytearray(compiled.ids), bytearray(compiled.variants), bytearray(compiled.transparency)
+            self.lighting = bytes(compiled.lighting) if compiled.lighting is not None else None
+            compiled.close()
+        # one shared tile object per type, with a byte per cell naming its type
+        self.rows = TileGrid(self.width, self.height, list(compressiondict.values()), ids)
+        self.variants = variants
+        self.transparency_map = GridView(transparency, self.width, self.height)
+        if not self.streaming:
+            self.decorate_level()
         self.player.inventory.generate_sprite(assets)
         self.player.add_inventory_items(item_data)
         ui = UserInterface(self.player, assets)
         self.player.ui = ui
-        assets.screen = pg.display.set_mode((assets.resolutionx, assets.resolutiony + self.player.ui.height))
+        # the display is only recreated when the interface changes its size
+        screensize = (assets.resolutionx, assets.resolutiony + self.player.ui.height)
+        if pg.display.get_surface() is None or pg.display.get_surface().get_size() != screensize:
+            assets.screen = pg.display.set_mode(screensize)
+        else:
+            assets.screen = pg.display.get_surface()
+
+    def compile(self, source, compressiondict) -> "CompiledLevel":
+        """Parses a level file and precomputes its tile ids, autotile
+        variants, transparency and base lighting for compiledlevel to cache.
+        """
+        spec = levelparser.load_level(source)
+        codes = {code: number for number, code in enumerate(compressiondict)}
+        try:
+            ids = levelparser.decode_tiles(spec.tiles, spec.width, spec.height, codes)
+        except levelparser.LevelFormatError as error:
+            raise levelparser.LevelFormatError("%s: %s" % (self.name, error)) from None
+        self.width = spec.width
+        self.height = spec.height
+        self.rows = TileGrid(self.width, self.height, list(compressiondict.values()), ids)
+        self.transparency_map = GridView(self.rows.attribute("transparent"), self.width, self.height)
+        self.variants = bytearray(self.width * self.height)
+        self.spritepass(self.ppb)
+        if self.width * self.height > chunks.STREAMINGCELLS:
+            # streamed levels are lit chunk by chunk as they come into view
+            return compiledlevel.CompiledLevel(self.width, self.height, spec.player, spec.entities, spec.items, "".join(compressiondict),
+                                               None, ids, self.variants, self.transparency_map.data, None)
+        self.lighting = None
+        self.lighting_version = 0
+        self.streaming = False
+        lighting = shader.Shader()
+        lighting.set_dimensions(self)
+        if lighting.use_numpy:
+            baselighting = lighting.baselighting.tobytes()
+        else:
+            baselighting = bytes(min(255, max(0, value)) for row in lighting.baselighting for value in row)
+        return compiledlevel.CompiledLevel(self.width, self.height, spec.player, spec.entities, spec.items, "".join(compressiondict),
+                                           (lighting.dropoff, lighting.diagonaldropoff), ids, self.variants, self.transparency_map.data, baselighting)
+
+    @property
+    def version(self) -> "Integer":
+        """Changes whenever rows or transparency_map are edited after
+        loading, which is only possible through their set() methods.
+        """
+        return self.rows.version + self.transparency_map.version
 
-        self.transparency_map = []
-        for i in range(len(self.rows)):
-            self.transparency_map.append([])
-            for j in range(len(self.rows[0])):
-                if self.rows[i][j].transparent == True:
-                    self.transparency_map[i].append(True)
-                else:
-                    self.transparency_map[i].append(False)
+    def base_lighting(self, dropoff, diagonaldropoff) -> "Bytes":
+        """Returns the precomputed base lighting, one byte per cell, if it was
+        spread with the same dropoffs and the layout has not changed since.
+        """
+        if self.lighting is not None and self.lighting_dropoff == (dropoff, diagonaldropoff) and self.lighting_version == self.version:
+            return self.lighting
+        return None
 
     def spritepass(self, ppb):
-        """Iterates through every tile and calls their choose_sprite()
-        method, if they have one.
+        """Stores the autotile variant of every cell whose tile has a
+        choose_variant() method.
         """
-        for i in range(0, len(self.rows)):
-            for j in range(0, len(self.rows[0])):
-                try:
-                    self.rows[i][j].choose_sprite((j, i), self.rows, ppb)
-                except:
-                    pass
+        if np is not None:
+            self.variants[:] = self.autotile()
+        else:
+            for i in range(self.height):
+                for j in range(self.width):
+                    self.choose_cell((j, i))
 
-    def generate_base_lighting(self):
-        baselighting = []
-        lights_to_preprocess = []
+    def decorate(self, chunk):
+        """Rolls the decoration of every cell in a chunk whose tile has a
+        choose_decoration() method, in order. Streamed chunks roll with a
+        generator seeded by their position, so a chunk that is dropped and
+        loaded again looks the same.
+        """
+        rng = random
+        if self.streaming:
+            rng = random.Random("%s %d %d" % (self.name, chunk.x, chunk.y))
+        rect = chunk.rect
+        chunk.decorations = bytearray(rect.width * rect.height)
+        chunk.decoration_offsets = array("b", bytes(2 * rect.width * rect.height))
+        for i in range(rect.top, rect.bottom):
+            decorating = self.rows.having("choose_decoration", (rect.left, i, rect.width, 1))
+            for j in range(rect.width):
+                if decorating[j]:
+                    decoration = self.rows[i][rect.left + j].choose_decoration(rng)
+                    if decoration is not None:
+                        self.set_decoration(chunk, (rect.left + j, i), decoration)
+
+    def decorate_level(self):
+        """Rolls the decorations of every chunk of a level that is not
+        streamed with the random module, cell by cell in row order across
+        the whole level, so chunk boundaries do not change the result.
+        """
+        for y in range((self.height - 1) // self.chunksize + 1):
+            for x in range((self.width - 1) // self.chunksize + 1):
+                chunk = self.chunk((x, y))
+                chunk.decorations = bytearray(chunk.rect.width * chunk.rect.height)
+                chunk.decoration_offsets = array("b", bytes(2 * chunk.rect.width * chunk.rect.height))
         for i in range(self.height):
-            baselighting.append([])
+            decorating = self.rows.having("choose_decoration", (0, i, self.width, 1))
             for j in range(self.width):
-                if self.rows[i][j].luminous:
-                    lights_to_preprocess.append([self.rows[i][j].light, j, i])
-                baselighting[i].append(self.rows[i][j].light)
+                if decorating[j]:
+                    decoration = self.rows[i][j].choose_decoration(random)
+                    if decoration is not None:
+                        self.set_decoration(self.chunks[self.chunk_of((j, i))], (j, i), decoration)
+
+    def set_decoration(self, chunk, position, decoration):
+        """Stores a decoration from choose_decoration(), or None, for the cell at an (x, y) position."""
+        index = (position[1] - chunk.rect.top) * chunk.rect.width + position[0] - chunk.rect.left
+        if decoration is None:
+            chunk.decorations[index] = 0
+            return
+        chunk.decorations[index] = decoration[0] + 1
+        chunk.decoration_offsets[2 * index:2 * index + 2] = array("b", decoration[1:])
+
+    def chunk_of(self, position) -> "(x, y)":
+        """Returns the position of the chunk holding the tile at an (x, y) position."""
+        return (position[0] // self.chunksize, position[1] // self.chunksize)
+
+    def chunk(self, position) -> "Chunk":
+        """Returns the chunk at an (x, y) chunk position, creating an empty one if needed."""
+        if position not in self.chunks:
+            x, y = position
+            rect = pg.Rect(x * self.chunksize, y * self.chunksize, self.chunksize, self.chunksize).clip(pg.Rect(0, 0, self.width, self.height))
+            self.chunks[position] = chunks.Chunk(x, y, rect)
+        return self.chunks[position]
+
+    def chunk_surface(self, chunk) -> "Surface":
+        """Returns the baked tile layer of a chunk, decorating and drawing it on first use."""
+        if chunk.decorations is None:
+            self.decorate(chunk)
+        if chunk.surface is None:
+            chunk.surface = pg.Surface((chunk.rect.width * self.ppb, chunk.rect.height * self.ppb)).convert()
+            decorations = blocks.decoration_sprites()
+            for i in range(chunk.rect.top, chunk.rect.bottom):
+                for j in range(chunk.rect.left, chunk.rect.right):
+                    self.draw_tile((j, i), decorations)
+        return chunk.surface
+
+    def chunk_surfaces(self, area) -> "List":
+        """Returns a (surface, rect) pair for every chunk overlapping an area
+        of the level given in pixels, with the rect of the chunk in pixels.
+        """
+        size = self.chunksize * self.ppb
+        surfaces = []
+        for y in range(max(0, area.top // size), min(self.height - 1, (area.bottom - 1) // self.ppb) // self.chunksize + 1):
+            for x in range(max(0, area.left // size), min(self.width - 1, (area.right - 1) // self.ppb) // self.chunksize + 1):
+                chunk = self.chunk((x, y))
+                rect = pg.Rect(chunk.rect.x * self.ppb, chunk.rect.y * self.ppb, chunk.rect.width * self.ppb, chunk.rect.height * self.ppb)
+                surfaces.append((self.chunk_surface(chunk), rect))
+        return surfaces
+
+    def stream(self, view):
+        """Keeps the chunks around a view of the level, given in tiles,
+        loaded. Chunks more than one chunk away from the view have their
+        baked surface dropped. Streamed levels drop those chunks entirely,
+        and entities are packed away when their chunk is not loaded and
+        unpacked again once it is. Chunks holding an entity that cannot be
+        packed, such as a projectile, stay loaded until it is gone.
+        """
+        left, top = self.chunk_of((view.left, view.top))
+        right, bottom = self.chunk_of((view.right - 1, view.bottom - 1))
+        keep = set((x, y) for y in range(top - 1, bottom + 2) for x in range(left - 1, right + 2))
+        if not self.streaming:
+            # the decorations of small levels are rolled once, so only the surfaces go
+            for position, chunk in self.chunks.items():
+                if position not in keep:
+                    chunk.surface = None
+            return
+        for entity in self.entities:
+            if not chunks.sleeps(entity):
+                keep.add(self.chunk_of((entity.x, entity.y)))
+        for position in list(self.chunks):
+            if position not in keep:
+                del self.chunks[position]
+        for entity in self.entities:
+            position = self.chunk_of((entity.x, entity.y))
+            if position not in keep:
+                self.entities.despawn(entity)
+                self.dormant.setdefault(position, []).append(chunks.pack_entity(entity))
+        self.entities.flush()
+        for position in keep:
+            if position in self.dormant:
+                for data in self.dormant.pop(position):
+                    self.entities.spawn(chunks.unpack_entity(data))
+
+    def chunk_lighting(self, chunk, lighting) -> "2D Array":
+        """Returns the base lighting of a streamed chunk, spread by a Shader
+        from the luminous tiles within reach of the chunk. The result is
+        an ndarray if the shader uses numpy and a list of rows otherwise.
+        """
+        dropoffs = (lighting.dropoff, lighting.diagonaldropoff)
+        if chunk.lighting is not None and chunk.lighting_dropoff == dropoffs and chunk.lighting_version == self.version:
+            return chunk.lighting
+        reach = max(0, (max(tile.light for tile in self.rows.tiletypes) - 1) // lighting.dropoff)
+        rect = chunk.rect.inflate(2 * reach, 2 * reach).clip(pg.Rect(0, 0, self.width, self.height))
+        light = self.rows.attribute("light", rect)
+        luminous = self.rows.attribute("luminous", rect)
+        window = [list(light[i * rect.width:(i + 1) * rect.width]) for i in range(rect.height)]
+        lights = [[light[index], rect.left + index % rect.width, rect.top + index // rect.width] for index in range(len(luminous)) if luminous[index]]
+        lighting.propagate_many(lights, window, rect.topleft)
+        left, top = chunk.rect.left - rect.left, chunk.rect.top - rect.top
+        window = [row[left:left + chunk.rect.width] for row in window[top:top + chunk.rect.height]]
+        if lighting.use_numpy:
+            window = np.array(window, dtype=np.int16).clip(0, 255).astype(np.uint8)
+        chunk.lighting = window
+        chunk.lighting_dropoff = dropoffs
+        chunk.lighting_version = self.version
+        return window
+
+    def lighting_window(self, rect, lighting) -> "2D Array":
+        """Returns the base lighting of a (left, top, right, bottom) rect of
+        a streamed level, gathered from the chunks covering it.
+        """
+        left, top, right, bottom = rect
+        right, bottom = max(left, right), max(top, bottom)
+        if lighting.use_numpy:
+            window = np.zeros((bottom - top, right - left), dtype=np.uint8)
+        else:
+            window = [[0] * (right - left) for i in range(bottom - top)]
+        for y in range(top // self.chunksize, (bottom - 1) // self.chunksize + 1):
+            for x in range(left // self.chunksize, (right - 1) // self.chunksize + 1):
+                chunk = self.chunk((x, y))
+                base = self.chunk_lighting(chunk, lighting)
+                part = chunk.rect.clip(pg.Rect(left, top, right - left, bottom - top))
+                for i in range(part.top, part.bottom):
+                    row = base[i - chunk.rect.top][part.left - chunk.rect.left:part.right - chunk.rect.left]
+                    window[i - top][part.left - left:part.right - left] = row
+        return window
+
+    def autotile(self) -> "Bytes":
+        """Computes the variant of every cell at once with numpy. Each cell is
+        compared with its 8 neighbours by group to build the neighbour mask
+        that choose_variant() would, which VARIANTLOOKUP turns into a variant.
+        Cells without a choose_variant() method get variant 0.
+        """
+        groups = {}
+        table = bytearray(256)
+        for number, tiletype in enumerate(self.rows.tiletypes):
+            table[number] = groups.setdefault(tiletype.group, len(groups))
+        # tiles outside the level never match, so the border gets its own group
+        grid = np.full((self.height + 2, self.width + 2), 255, dtype=np.uint8)
+        grid[1:-1, 1:-1] = np.frombuffer(self.rows.ids.translate(table), dtype=np.uint8).reshape(self.height, self.width)
+        centre = grid[1:-1, 1:-1]
+        masks = np.zeros((self.height, self.width), dtype=np.uint8)
+        for bit, (x, y) in enumerate(blocks.NEIGHBOURS):
+            neighbour = grid[1 + y:self.height + 1 + y, 1 + x:self.width + 1 + x]
+            masks |= (neighbour != centre).astype(np.uint8) << (7 - bit)
+        variants = np.frombuffer(blocks.VARIANTLOOKUP, dtype=np.uint8)[masks]
+        variants[np.frombuffer(self.rows.having("choose_variant"), dtype=np.uint8).reshape(self.height, self.width) == 0] = 0
+        return variants.tobytes()
+
+    def choose_cell(self, position):
+        """Stores the variant for one cell."""
+        x, y = position
+        tile = self.rows[y][x]
+        if hasattr(tile, "choose_variant"):
+            self.variants[y * self.width + x] = tile.choose_variant(position, self.rows)
+
+    def tile_sprite(self, position) -> "Surface":
+        """Returns the shared sprite of the tile at an (x, y) position."""
+        x, y = position
+        tile = self.rows[y][x]
+        if hasattr(tile, "choose_variant"):
+            return tile.variant_sprite(self.variants[y * self.width + x], self.ppb)
+        return tile.sprite
+
+    def draw_tile(self, position, decorations):
+        """Draws one cell and its decoration, if any, onto the baked layer of
+        its chunk. Cells in chunks that are not drawn yet are skipped.
+        """
+        x, y = position
+        chunk = self.chunks.get(self.chunk_of(position))
+        if chunk is None or chunk.surface is None:
+            return
+        index = (y - chunk.rect.top) * chunk.rect.width + x - chunk.rect.left
+        rect = pg.Rect((x - chunk.rect.left) * self.ppb, (y - chunk.rect.top) * self.ppb, self.ppb, self.ppb)
+        chunk.surface.blit(self.tile_sprite(position), rect)
+        if chunk.decorations[index]:
+            blittable = decorations[chunk.decorations[index] - 1]
+            offset = chunk.decoration_offsets[2 * index:2 * index + 2]
+            location = self.rows[y][x].decoration_location(blittable, offset, self.ppb)
+            # decorations are cut off at the edge of their own tile
+            chunk.surface.set_clip(rect)
+            chunk.surface.blit(blittable, (rect.x + location[0], rect.y + location[1]))
+            chunk.surface.set_clip(None)
+
+    def set_tile(self, position, tile):
+        """Replaces the tile at an (x, y) position after the level has loaded.
+        Neighbouring variants are re-chosen and redrawn on the baked layer,
+        and the version changes so the shader rebuilds its lighting.
+        """
+        x, y = position
+        self.rows.set(position, tile)
+        self.transparency_map.set(position, tile.transparent)
+        chunk = self.chunks.get(self.chunk_of(position))
+        if chunk is not None and chunk.decorations is not None:
+            self.set_decoration(chunk, position, tile.choose_decoration() if hasattr(tile, "choose_decoration") else None)
+        decorations = blocks.decoration_sprites()
+        for i in range(max(0, y - 1), min(self.height, y + 2)):
+            for j in range(max(0, x - 1), min(self.width, x + 2)):
+                self.choose_cell((j, i))
+                self.draw_tile((j, i), decorations)
+
+    def generate_base_lighting(self):
+        light = self.rows.attribute("light")
+        luminous = self.rows.attribute("luminous")
+        baselighting = [list(light[i * self.width:(i + 1) * self.width]) for i in range(self.height)]
+        lights_to_preprocess = [[light[index], index % self.width, index // self.width] for index in range(len(luminous)) if luminous[index]]
         return baselighting, lights_to_preprocess
 
-    def convert_data(self, data):
-        instructions = ""
-        current = ""
-        for character in data:
-            try:
-                int(character)
-                current += character
-            except ValueError:
-                instructions += int(current) * character
-                current = ""
-        return instructions
\ No newline at end of file
+class Occupancy():
+    """Index of the entities on each tile of a level. cells maps an (x, y)
+    position to the list of entities on it, and positions maps each entity
+    to the cell it is listed in. Entities that are added keep the index up
+    to date themselves whenever Entity.move() changes their position.
+    Lookups return copies, so the index can only change through add(),
+    remove() and moved().
+    """
+    def __init__(self):
+        self.cells = {}
+        self.positions = {}
+
+    def add(self, entity):
+        position = (entity.x, entity.y)
+        self.cells.setdefault(position, []).append(entity)
+        self.positions[entity] = position
+        entity.occupancy = self
+
+    def remove(self, entity):
+        position = self.positions.pop(entity)
+        cell = self.cells[position]
+        cell.remove(entity)
+        if not cell:
+            del self.cells[position]
+        entity.occupancy = None
+
+    def moved(self, entity):
+        """Moves an entity to the cell of its current position."""
+        self.remove(entity)
+        self.add(entity)
+
+    def at(self, position) -> "Tuple":
+        """Returns the entities on the tile at an (x, y) position."""
+        return tuple(self.cells.get(tuple(position), ()))
+
+    def in_rect(self, rect) -> "List":
+        """Returns a new list of the entities within a (left, top, width,
+        height) rect of tiles, in no particular order, looking up each tile
+        of the rect or, if there are fewer occupied tiles than that,
+        checking each occupied tile instead.
+        """
+        left, top, width, height = rect
+        found = []
+        if width * height > len(self.cells):
+            for (x, y), cell in self.cells.items():
+                if left <= x < left + width and top <= y < top + height:
+                    found.extend(cell)
+            return found
+        for y in range(top, top + height):
+            for x in range(left, left + width):
+                if (x, y) in self.cells:
+                    found.extend(self.cells[(x, y)])
+        return found
+
+class TileGrid():
+    """Compact level layout. Every cell is one byte in ids naming its tile
+    type in tiletypes, and the tile objects are shared by all cells of that
+    type, so rows[y][x].weight style access still works without an object
+    per cell. Attributes of every cell can be packed into a bytearray with
+    attribute(). Cells can only be changed with set(), which bumps version.
+    """
+    def __init__(self, width, height, tiletypes, ids):
+        self.width = width
+        self.height = height
+        self.tiletypes = tiletypes
+        self.ids = ids
+        self.version = 0
+        self.rowviews = [TileRow(self, i * width) for i in range(height)]
+
+    def __getitem__(self, y):
+        return self.rowviews[y]
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        return iter(self.rowviews)
+
+    def type_id(self, tile) -> "Integer":
+        """Returns the id of a tile object, adding it as a new type if needed."""
+        for number, tiletype in enumerate(self.tiletypes):
+            if tiletype is tile:
+                return number
+        if len(self.tiletypes) == 256:
+            raise ValueError("a level can hold at most 256 tile types")
+        self.tiletypes.append(tile)
+        return len(self.tiletypes) - 1
+
+    def set(self, position, tile):
+        """Changes the tile type of the cell at an (x, y) position."""
+        self.ids[position[1] * self.width + position[0]] = self.type_id(tile)
+        self.version += 1
+
+    def attribute(self, name, rect=None) -> "Bytes":
+        """Returns a numeric attribute of every cell, or of the cells in a
+        (left, top, width, height) rect row by row, one byte per cell.
+        """
+        table = bytearray(256)
+        for number, tiletype in enumerate(self.tiletypes):
+            table[number] = int(getattr(tiletype, name))
+        return self.cells(rect).translate(table)
+
+    def having(self, name, rect=None) -> "Bytes":
+        """Marks every cell, or the cells in a rect, whose tile has an attribute."""
+        table = bytearray(256)
+        for number, tiletype in enumerate(self.tiletypes):
+            table[number] = hasattr(tiletype, name)
+        return self.cells(rect).translate(table)
+
+    def cells(self, rect=None) -> "Bytes":
+        """Returns the ids of every cell, or of the cells in a rect row by row."""
+        if rect is None:
+            return bytes(self.ids)
+        left, top, width, height = rect
+        return b"".join(self.ids[(top + i) * self.width + left:(top + i) * self.width + left + width] for i in range(height))
+
+class TileRow():
+    """One row of a TileGrid, indexed like a list of tiles."""
+    __slots__ = ("grid", "offset")
+
+    def __init__(self, grid, offset):
+        self.grid = grid
+        self.offset = offset
+
+    def __getitem__(self, x):
+        width = self.grid.width
+        if x < 0:
+            x += width
+        if not 0 <= x < width:
+            raise IndexError("tile index out of range")
+        return self.grid.tiletypes[self.grid.ids[self.offset + x]]
+
+    def __len__(self):
+        return self.grid.width
+
+    def __iter__(self):
+        for x in range(self.grid.width):
+            yield self[x]
+
+class GridView():
+    """[y][x] access to a flat bytearray holding one value per cell. Rows
+    are read-only memoryviews into the bytearray, so cells can only be
+    changed with set(), which bumps version, and numpy can read the whole
+    grid without copying cell by cell.
+    """
+    def __init__(self, data, width, height):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.version = 0
+        view = memoryview(data).toreadonly()
+        self.rowviews = [view[i * width:(i + 1) * width] for i in range(height)]
+
+    def set(self, position, value):
+        """Changes the value of the cell at an (x, y) position."""
+        self.data[position[1] * self.width + position[0]] = value
+        self.version += 1
+
+    def __getitem__(self, y):
+        return self.rowviews[y]
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        return iter(self.rowviews)
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy
+        array = numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(self.height, self.width)
+        return array.astype(dtype if dtype is not None else numpy.uint8)
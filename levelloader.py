@@ -0,0 +1,52 @@
+"""Prepares the levels a game is likely to load next on a worker thread."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import leveldata
+import levelparser
+
+class LevelLoader():
+    """Compiles the destinations of a level's teleporters in the background
+    with leveldata.prepare(), which covers parsing, RLE decoding, autotiling
+    and base lighting, so that loading one of them only has to build the
+    LevelData from a ready compiled level.
+    """
+    def __init__(self, assets):
+        self.assets = assets
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="levelloader")
+        # level name -> future of its compiled level
+        self.pending = {}
+
+    def scan(self, level):
+        """Starts preparing every level reachable from a level's teleporters,
+        and forgets levels prepared for the previous one. A level that is
+        already being prepared cannot be cancelled, so it is kept for take()
+        to wait on rather than prepared a second time alongside it.
+        """
+        destinations = [name for name in level.destinations if os.path.isfile("levels/" + name)]
+        for name in list(self.pending):
+            if name not in destinations and self.pending[name].cancel():
+                del self.pending[name]
+        for name in destinations:
+            if name not in self.pending:
+                self.pending[name] = self.executor.submit(leveldata.prepare, name, leveldata.tile_types(self.assets.ppb), self.assets.ppb)
+
+    def take(self, name) -> "CompiledLevel":
+        """Returns the prepared level, waiting for it if it is still being
+        prepared, or None if it was not requested or could not be read or
+        parsed, in which case LevelData prepares it again and reports the
+        error. Any other error is raised here.
+        """
+        future = self.pending.pop(name, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            return future.result()
+        except (OSError, levelparser.LevelFormatError):
+            return None
+
+    def close(self):
+        """Cancels every level not yet being prepared and waits for the
+        worker to finish the one that is, so no cache file is left half written.
+        """
+        self.pending = {}
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,271 @@
+"""Safe parser for level files and the object specs inside them.
+
+A level file is one line of "width|height|Player(...)|RLE tiles|Entity(...)/Entity(...)"
+optionally followed by a line of space separated items such as "Longsword() Bomb()".
+Object specs are parsed into plain (name, arguments) tuples and only classes
+registered with register() can be built from them, with every argument
+checked against the type it was registered with. Nothing is ever executed.
+"""
+import ast
+import inspect
+import os
+import re
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# argument type for (x, y) tuples of integers
+POSITION = "position"
+# namespace -> class name -> (class, {parameter: type} in parameter order, required parameters)
+registry = {}
+# path -> (modification time, size, LevelSpec)
+levelcache = {}
+# one run of tiles in the RLE tile field, such as "26w"
+RUN = re.compile(r"(\d+)(\D)")
+
+class LevelFormatError(ValueError):
+    """Raised for any level or object spec that cannot be parsed."""
+
+class LevelSpec():
+    """The parsed contents of a level file. Holds only immutable data, so
+    one instance can be cached and built from any number of times.
+    """
+    def __init__(self, width, height, player, tiles, entities, items):
+        self.width = width
+        self.height = height
+        self.player = player
+        self.tiles = tiles
+        self.entities = entities
+        self.items = items
+
+def register(namespace, cls, **parameters):
+    """Allows cls to be built from specs in a namespace. Keyword arguments
+    give the type of each constructor parameter, in the order positional
+    arguments are assigned to them. Constructor parameters without a
+    default must be given by every spec.
+    """
+    required = tuple(name for name, parameter in inspect.signature(cls).parameters.items()
+                     if parameter.default is parameter.empty and parameter.kind in (parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY))
+    registry.setdefault(namespace, {})[cls.__name__] = (cls, parameters, required)
+
+def check_type(value, kind) -> "Boolean":
+    if kind == POSITION:
+        return isinstance(value, tuple) and len(value) == 2 and all(check_type(number, int) for number in value)
+    if kind is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+@lru_cache(maxsize=1024)
+def parse_spec(text, namespace) -> "Tuple":
+    """Parses one spec such as 'Caveman((1, 1), health=80)' into a
+    (class name, ((parameter, value), ...)) tuple. Raises LevelFormatError
+    if the text is not a call of a class registered in the namespace with
+    literal arguments of the registered types, including every required one.
+    """
+    try:
+        node = ast.parse(text.strip(), mode="eval").body
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        raise LevelFormatError("%r is not a valid spec" % text) from None
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        raise LevelFormatError("%r is not a call such as Name(...)" % text)
+    name = node.func.id
+    if name not in registry.get(namespace, {}):
+        raise LevelFormatError("%r is not a known %s class" % (name, namespace))
+    parameters = registry[namespace][name][1]
+    names = list(parameters)
+    arguments = []
+    if len(node.args) > len(names):
+        raise LevelFormatError("%s takes at most %d arguments" % (name, len(names)))
+    for parameter, argument in zip(names, node.args):
+        arguments.append((parameter, argument))
+    for keyword in node.keywords:
+        if keyword.arg is None or keyword.arg not in parameters:
+            raise LevelFormatError("%s has no parameter %r" % (name, keyword.arg))
+        arguments.append((keyword.arg, keyword.value))
+    values = []
+    for parameter, argument in arguments:
+        if isinstance(argument, ast.Starred):
+            raise LevelFormatError("%s arguments cannot be unpacked" % name)
+        try:
+            value = ast.literal_eval(argument)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            raise LevelFormatError("%s parameter %r must be a literal" % (name, parameter)) from None
+        if isinstance(value, list):
+            value = tuple(value)
+        values.append((parameter, value))
+    spec = (name, tuple(values))
+    check_spec(spec, namespace)
+    return spec
+
+def check_spec(spec, namespace):
+    """Raises LevelFormatError unless a (class name, ((parameter, value), ...))
+    spec names a class registered in the namespace and gives each of its
+    registered parameters at most once, with the registered type, and
+    every required one. Used by parse_spec() and for specs read back from
+    compiled levels, which may have been compiled against other classes.
+    """
+    name, values = spec
+    if name not in registry.get(namespace, {}):
+        raise LevelFormatError("%r is not a known %s class" % (name, namespace))
+    parameters = registry[namespace][name][1]
+    given = []
+    for parameter, value in values:
+        if parameter not in parameters:
+            raise LevelFormatError("%s has no parameter %r" % (name, parameter))
+        if parameter in given:
+            raise LevelFormatError("%s got parameter %r more than once" % (name, parameter))
+        if not check_type(value, parameters[parameter]):
+            kind = parameters[parameter]
+            raise LevelFormatError("%s parameter %r must be %s, not %r" % (name, parameter, kind if kind == POSITION else kind.__name__, value))
+        given.append(parameter)
+    for parameter in registry[namespace][name][2]:
+        if parameter not in given:
+            raise LevelFormatError("%s is missing required parameter %r" % (name, parameter))
+
+def build(spec, namespace) -> "Object":
+    """Creates a new object from a spec checked by check_spec(), raising
+    LevelFormatError if its class is not registered.
+    """
+    name, values = spec
+    try:
+        cls = registry[namespace][name][0]
+    except KeyError:
+        raise LevelFormatError("%r is not a known %s class" % (name, namespace)) from None
+    return cls(**dict(values))
+
+def tile_runs(text):
+    """Generator of the (count, tile character) runs in an RLE tile field,
+    raising LevelFormatError at the first character that is not part of a run.
+    """
+    position = 0
+    for match in RUN.finditer(text):
+        if match.start() != position:
+            break
+        position = match.end()
+        yield int(match.group(1)), match.group(2)
+    if position != len(text):
+        raise LevelFormatError("bad tile data at character %d: %r" % (position, text[position:position + 10]))
+
+def decode_tiles(text, width, height, codes, out=None) -> "Bytearray":
+    """Decodes an RLE tile field into a bytearray of width * height tile ids,
+    or into out if a preallocated bytearray is given. codes maps each tile
+    character to its id, and the runs must cover exactly every cell.
+    """
+    total = width * height
+    if out is None:
+        out = bytearray(total)
+    if np is not None and text.isascii():
+        return decode_tiles_numpy(text, width, height, codes, out)
+    position = 0
+    for count, tile in tile_runs(text):
+        if tile not in codes:
+            raise LevelFormatError("unknown tile %r, expected one of %r" % (tile, "".join(codes)))
+        if position + count > total:
+            raise LevelFormatError("tiles cover more than %dx%d cells" % (width, height))
+        out[position:position + count] = codes[tile].to_bytes(1, "little") * count
+        position += count
+    if position != total:
+        raise LevelFormatError("tiles cover %d of %dx%d cells" % (position, width, height))
+    return out
+
+def decode_tiles_numpy(text, width, height, codes, out) -> "Bytearray":
+    """decode_tiles() for ascii text without a Python step per run. The run
+    lengths are summed from their digits by place value and the tile ids
+    are expanded with a single repeat into out.
+    """
+    total = width * height
+    data = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    digits = (data >= 48) & (data <= 57)
+    ends = np.flatnonzero(~digits)
+    # every run is at least one digit followed by exactly one tile
+    starts = np.concatenate(([0], ends + 1))[:len(ends)]
+    bad = np.flatnonzero(ends == starts)
+    if len(data) and digits[-1]:
+        bad = np.append(bad, len(ends))
+    if len(bad):
+        position = int(starts[bad[0]]) if bad[0] < len(ends) else int(ends[-1] + 1 if len(ends) else 0)
+        raise LevelFormatError("bad tile data at character %d: %r" % (position, text[position:position + 10]))
+    if len(ends) and (ends - starts).max() > 15:
+        raise LevelFormatError("tiles cover more than %dx%d cells" % (width, height))
+    table = np.full(256, 255, dtype=np.uint8)
+    for tile, number in codes.items():
+        table[ord(tile)] = number
+    tiles = table[data[ends]]
+    if (tiles == 255).any():
+        tile = chr(data[ends][tiles == 255][0])
+        raise LevelFormatError("unknown tile %r, expected one of %r" % (tile, "".join(codes)))
+    # place value of every digit from its distance to the end of its run
+    run = np.cumsum(~digits) - ~digits
+    places = ends[run[digits]] - np.flatnonzero(digits) - 1
+    values = (data[digits] - 48).astype(np.int64) * 10 ** places.astype(np.int64)
+    counts = np.add.reduceat(values, starts - np.arange(len(starts))) if len(ends) else values
+    if counts.sum() > total:
+        raise LevelFormatError("tiles cover more than %dx%d cells" % (width, height))
+    if counts.sum() != total:
+        raise LevelFormatError("tiles cover %d of %dx%d cells" % (counts.sum(), width, height))
+    np.frombuffer(out, dtype=np.uint8)[:total] = np.repeat(tiles, counts)
+    return out
+
+def encode_tiles(tiles, characters=None) -> "String":
+    """Encodes tiles into an RLE tile field. tiles is a string of tile
+    characters, or a bytes-like object of tile ids when characters, a
+    sequence of the character for each id, is given.
+    """
+    if characters is not None:
+        table = bytearray(256)
+        for number, character in enumerate(characters):
+            table[number] = ord(character)
+        tiles = bytes(tiles).translate(table).decode("latin-1")
+    if np is not None and tiles.isascii() and tiles:
+        data = np.frombuffer(tiles.encode("ascii"), dtype=np.uint8)
+        starts = np.concatenate(([0], np.flatnonzero(data[1:] != data[:-1]) + 1))
+        lengths = np.diff(np.append(starts, len(data)))
+        return "".join(map("%d%s".__mod__, zip(lengths.tolist(), data[starts].tobytes().decode("ascii"))))
+    return "".join("%d%s" % (len(run.group()), run.group(1)) for run in re.finditer(r"(.)\1*", tiles, re.S))
+
+def parse_level(text, name="level") -> "LevelSpec":
+    """Parses the text of a level file, naming the level in any errors."""
+    lines = text.split("\n")
+    fields = lines[0].split("|")
+    try:
+        if len(fields) not in (4, 5):
+            raise LevelFormatError("expected 5 fields separated by '|', found %d" % len(fields))
+        try:
+            width, height = int(fields[0]), int(fields[1])
+        except ValueError:
+            raise LevelFormatError("width and height must be integers") from None
+        if width <= 0 or height <= 0:
+            raise LevelFormatError("width and height must be positive")
+        player = parse_spec(fields[2], "player")
+        entities = []
+        if len(fields) == 5 and fields[4].strip() != "":
+            for number, entitystring in enumerate(fields[4].split("/")):
+                try:
+                    entities.append(parse_spec(entitystring, "entities"))
+                except LevelFormatError as error:
+                    raise LevelFormatError("entity %d: %s" % (number + 1, error)) from None
+        items = []
+        if len(lines) > 1:
+            items = [item for item in lines[1].split(" ") if item.strip() != ""]
+            for item in items:
+                parse_spec(item, "items")
+    except LevelFormatError as error:
+        raise LevelFormatError("%s: %s" % (name, error)) from None
+    return LevelSpec(width, height, player, fields[3], tuple(entities), tuple(items))
+
+def load_level(path) -> "LevelSpec":
+    """Returns the parsed level at path. Parsed levels are cached until
+    the file changes, so reloading a level never parses it again.
+    """
+    stat = os.stat(path)
+    cached = levelcache.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, "r") as f:
+        level = parse_level(f.read(), path)
+    levelcache[path] = (stat.st_mtime_ns, stat.st_size, level)
+    return level
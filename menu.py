@@ -46,6 +46,10 @@ class Menu():
                             self.state = "main"
                             return selected
             self.render()
+            if game.startup_time is None:
+                game.record_startup()
+            # load gameplay sprites in the background of the menu
+            next(game.preloader, None)
             pg.event.pump()
 
     def render(self):
@@ -0,0 +1,154 @@
+"""Pathfinding shared by every entity on a level.
+
+A FlowField holds the distance from every tile within reach of a target,
+normally the player, to that target. It is built once per turn and each
+entity then finds its next step by comparing its four neighbours, so the
+cost of a turn does not grow with the number of enemies. A field is widened
+at most once, the first time an entity chasing the target is outside it.
+find_path() is a budgeted A* search for one-off routes between two tiles.
+"""
+import heapq
+from array import array
+import pygame as pg
+
+# how far in tiles from the target a flow field is spread
+FIELDREACH = 32
+# distance of the tiles a flow field cannot reach
+UNREACHABLE = 0xFFFF
+# most tiles find_path() expands before giving up
+PATHBUDGET = 2000
+# (dx, dy) of the four tiles an entity can step to, in numpad order 4 6 8 2
+STEPS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+def blocks(entity) -> "Boolean":
+    """Checks whether an entity keeps other entities off its tile."""
+    return not entity.walkable
+
+def occupied(occupancy, position) -> "Boolean":
+    """Checks whether a tile holds an entity that blocks it, using a level's Occupancy index."""
+    return occupancy is not None and any(blocks(entity) for entity in occupancy.at(position))
+
+class FlowField():
+    """Distances to a target from every tile within reach of it, spread
+    with Dijkstra's algorithm. Entering a tile costs its weight, so tiles
+    with a weight of 0 are solid. Tiles under entities that block movement
+    and are not enemies, such as teleporters, are solid too, while enemies
+    are left out since they move out of each other's way.
+    """
+    def __init__(self, level, target, reach=FIELDREACH):
+        self.level = level
+        self.target = tuple(target)
+        self.reach = reach
+        self.widened = False
+        self.spread(reach)
+
+    def spread(self, reach):
+        """Fills in the distances of every tile within reach of the target."""
+        level, target = self.level, self.target
+        self.reach = reach
+        self.rect = pg.Rect(target[0] - reach, target[1] - reach, 2 * reach + 1, 2 * reach + 1).clip(pg.Rect(0, 0, level.width, level.height))
+        width = self.rect.width
+        weights = bytearray(level.rows.attribute("weight", self.rect))
+        for entity in level.occupancy.in_rect(self.rect):
+            if blocks(entity) and not entity.enemy:
+                weights[(entity.y - self.rect.top) * width + entity.x - self.rect.left] = 0
+        self.distances = array("H", [UNREACHABLE]) * len(weights)
+        start = (target[1] - self.rect.top) * width + target[0] - self.rect.left
+        if self.rect.collidepoint(target):
+            self.distances[start] = 0
+            queue = [(0, start)]
+        else:
+            queue = []
+        distances = self.distances
+        while queue:
+            distance, index = heapq.heappop(queue)
+            if distance > distances[index]:
+                continue
+            x = index % width
+            for neighbour in (index - 1 if x > 0 else -1, index + 1 if x < width - 1 else -1, index - width, index + width):
+                if 0 <= neighbour < len(weights) and weights[neighbour]:
+                    cost = distance + weights[neighbour]
+                    if cost < distances[neighbour]:
+                        distances[neighbour] = cost
+                        heapq.heappush(queue, (cost, neighbour))
+
+    def covers(self, position) -> "Boolean":
+        """Checks whether a tile is within the area the field was spread over."""
+        return self.rect.collidepoint(position)
+
+    def widen(self, position):
+        """Spreads the field again far enough to cover a tile, at least
+        doubling its reach. Only the first call does anything, so a field
+        is spread at most twice however many entities are outside it.
+        """
+        if self.widened:
+            return
+        self.widened = True
+        self.spread(max(2 * self.reach, abs(position[0] - self.target[0]), abs(position[1] - self.target[1])))
+
+    def reaches(self, position) -> "Boolean":
+        """Checks whether there is a route from a tile to the target."""
+        return self.distance(position) != UNREACHABLE
+
+    def distance(self, position) -> "Integer":
+        """Returns the cost of the route from a tile to the target, or UNREACHABLE."""
+        x, y = position[0] - self.rect.left, position[1] - self.rect.top
+        if not (0 <= x < self.rect.width and 0 <= y < self.rect.height):
+            return UNREACHABLE
+        return self.distances[y * self.rect.width + x]
+
+    def next_step(self, position, occupancy=None) -> "(x, y)":
+        """Returns the neighbouring tile that brings an entity at a position
+        closest to the target without stepping onto a tile occupied by an
+        entity that blocks it, or the position itself if there is none.
+        Ties go to the axis the target is furthest along, like simple_pathfind().
+        """
+        x, y = position
+        alongx = abs(self.target[0] - x) >= abs(self.target[1] - y)
+        best = tuple(position)
+        bestkey = (self.distance(position), 0)
+        for dx, dy in STEPS:
+            step = (x + dx, y + dy)
+            key = (self.distance(step), 0 if (dx != 0) == alongx else 1)
+            if key < bestkey and not occupied(occupancy, step):
+                best, bestkey = step, key
+        return best
+
+def find_path(layout, start, goal, occupancy=None, budget=PATHBUDGET) -> "List":
+    """A* search from start to goal over a level layout, such as
+    LevelData.rows, avoiding tiles with a weight of 0 and, if an Occupancy
+    index is given, tiles held by entities that block movement. Returns
+    the list of tiles after start up to and including goal, or None if
+    there is no route or none was found within budget expanded tiles.
+    """
+    start, goal = tuple(start), tuple(goal)
+    height, width = len(layout), len(layout[0])
+    def estimate(position):
+        return abs(position[0] - goal[0]) + abs(position[1] - goal[1])
+    costs = {start: 0}
+    previous = {}
+    queue = [(estimate(start), 0, start)]
+    expanded = 0
+    while queue and expanded < budget:
+        total, cost, position = heapq.heappop(queue)
+        if position == goal:
+            path = []
+            while position != start:
+                path.append(position)
+                position = previous[position]
+            return path[::-1]
+        if cost > costs[position]:
+            continue
+        expanded += 1
+        for dx, dy in STEPS:
+            step = (position[0] + dx, position[1] + dy)
+            if not (0 <= step[0] < width and 0 <= step[1] < height):
+                continue
+            weight = layout[step[1]][step[0]].weight
+            if weight == 0 or (step != goal and occupied(occupancy, step)):
+                continue
+            if step not in costs or cost + weight < costs[step]:
+                costs[step] = cost + weight
+                previous[step] = position
+                heapq.heappush(queue, (cost + weight + estimate(step), cost + weight, step))
+    return None
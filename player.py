@@ -3,6 +3,7 @@ import pygame as pg
 import random
 from inventory import Inventory
 import utils
+import levelparser
 import time
 import os
 
@@ -27,20 +28,8 @@ class Player():
         self.turn = True
         self.inventory = Inventory(self)
 
-        self.rsprites = utils.make_dict("./sprites/player/")
-        # extending idle animation artificially
-        self.rsprites["idle-1-7"] = self.rsprites["idle-1-3"]
-        self.rsprites["idle-1-6"] = self.rsprites["idle-1-3"]
-        self.rsprites["idle-1-5"] = self.rsprites["idle-1-2"]
-        self.rsprites["idle-1-4"] = self.rsprites["idle-1-2"]
-        self.rsprites["idle-1-3"] = self.rsprites["idle-1-1"]
-        self.rsprites["idle-1-2"] = self.rsprites["idle-1-1"]
-        self.rsprites["idle-1-1"] = self.rsprites["idle-1-0"]
-        self.lsprites = {}
-        for key in self.rsprites.keys():
-            self.lsprites[key] = pg.transform.flip(self.rsprites[key], True, False)
         self.animation_tick = 0
-        self.arrowsprites = utils.make_dict("./sprites/arrows/")
+        self.load_sprites()
         self.sprite = self.lsprites["idle-1-0"]
         self.sprite_state = "idle-1-"
         self.animation_delay = 5
@@ -53,6 +42,8 @@ class Player():
         self.attacked = False
         self.casting = False
         self.turn = True
+        # visibility.FieldOfView from the player's tile, computed once per turn
+        self.view = None
 
     def add_inventory_items(self, itemlist):
         """Adds a list of items to the inventory,
@@ -117,8 +108,8 @@ class Player():
         """Checks if a particular tile has a solid block or entity on it."""
         if level.rows[position[1]][position[0]].weight == 0:
             return False
-        for entity in level.entities:
-            if entity.walkable == False and (entity.x, entity.y) == position:
+        for entity in level.occupancy.at(position):
+            if entity.walkable == False:
                 return False
         return True
 
@@ -163,13 +154,43 @@ class Player():
         MUST be called inside Game, as the routine requires pixels per block as a
         parameter.
         """
-        # not particularly efficient as a result of using eval() when calling __init__
-        for key in self.rsprites.keys():
-            self.rsprites[key] = pg.transform.scale(self.rsprites[key], (size, size))
-        for key in self.lsprites.keys():
-            self.lsprites[key] = pg.transform.scale(self.lsprites[key], (size, size))
-        for key in self.arrowsprites.keys():
-            self.arrowsprites[key] = pg.transform.scale(self.arrowsprites[key], (size, size))
+        self.load_sprites(size)
+        if self.facingleft:
+            self.sprite = self.lsprites[self.sprite_state + str(self.animation_frame)]
+        else:
+            self.sprite = self.rsprites[self.sprite_state + str(self.animation_frame)]
     
+    def load_sprites(self, size=None):
+        """Fetches the player and arrow sprites from the shared sprite cache,
+        scaled to size if one is given, so that no player touches the disk
+        after the first one and every player shares the same surfaces.
+        """
+        if size is None:
+            rsprites = utils.spritecache.load_directory("./sprites/player/")
+            self.arrowsprites = utils.spritecache.load_directory("./sprites/arrows/")
+        else:
+            rsprites = utils.spritecache.scaled_directory("./sprites/player/", size)
+            self.arrowsprites = utils.spritecache.scaled_directory("./sprites/arrows/", size)
+        def extend_idle():
+            sprites = dict(rsprites)
+            # extending idle animation artificially
+            sprites["idle-1-7"] = sprites["idle-1-3"]
+            sprites["idle-1-6"] = sprites["idle-1-3"]
+            sprites["idle-1-5"] = sprites["idle-1-2"]
+            sprites["idle-1-4"] = sprites["idle-1-2"]
+            sprites["idle-1-3"] = sprites["idle-1-1"]
+            sprites["idle-1-2"] = sprites["idle-1-1"]
+            sprites["idle-1-1"] = sprites["idle-1-0"]
+            return sprites
+        self.rsprites = utils.spritecache.variant(("player", size), extend_idle)
+        def flip():
+            sprites = {}
+            for key in self.rsprites.keys():
+                sprites[key] = pg.transform.flip(self.rsprites[key], True, False)
+            return sprites
+        self.lsprites = utils.spritecache.variant(("player flipped", size), flip)
+
     def damage(self, damage, extras=None):
-        self.health -= damage
\ No newline at end of file
+        self.health -= damage
+
+levelparser.register("player", Player, position=levelparser.POSITION, starting_health=int, max_health=int, base_dmg=int)
@@ -1,12 +1,27 @@
 import copy
-
-rnd = lambda n: 3*round(n/3) + 1
+from collections import Counter, OrderedDict
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Shader():
     def __init__(self):
         self.dropoff = 35
         self.diagonaldropoff = round(self.dropoff * 1.4)
-        self.upscale = False
+        # smooth filters the shadow overlay when it is scaled up to the screen
+        self.smooth = False
+        # upscale splits every tile into upscale_factor squared sub-tiles lit by
+        # bilinear interpolation between tile centres, giving soft lighting
+        self.upscale = np is not None
+        self.upscale_factor = 3
+        self.upscale_weights = {}
+        # numpy mode keeps the light maps as ndarrays and composes lights
+        # with element-wise maximums instead of copying lists every frame
+        self.use_numpy = np is not None
+        # propagated light stamps keyed by (intensity, x, y), least recently used first
+        self.stamp_cache = OrderedDict()
+        self.stamp_cache_size = 512
         
 
     def set_dimensions(self, level):
@@ -14,86 +29,299 @@ class Shader():
         based on level passed. Should be called on every load
         and reload to avoid shadows breaking.
         """
+        self.level = level
+        self.map_version = level.version
+        self.stamp_cache.clear()
         self.arrayx = level.width
         self.arrayy = level.height
         self.transparency_map = level.transparency_map
-        self.baselighting, preprocesslights = level.generate_base_lighting()
-        for light in preprocesslights:
-            self.recurse(light, self.baselighting)
-        self.empty_scaled_array = []
-        for i in range(3 * self.arrayy):
-            self.empty_scaled_array.append([])
-            for j in range(3 * self.arrayx):
-                self.empty_scaled_array[i].append(None)
-        ...
-
-    def recurse(self, light, array):
-        """Recurses a light vector3 into adjacent tiles if possible."""
-        if light[0] <= 0:
-            return
-        if array[light[2]][light[1]] > light[0]:
+        if level.streaming:
+            # streamed levels are lit a window at a time by generate_view_array()
+            self.baselighting = None
+            if self.use_numpy:
+                self.transparency_array = np.frombuffer(self.transparency_map.data, dtype=np.uint8).reshape(self.arrayy, self.arrayx).view(bool)
             return
-        array[light[2]][light[1]] = light[0]
-        if not self.transparency_map[light[2]][light[1]]:
+        # levels loaded from the compiled cache carry their base lighting
+        lighting = level.base_lighting(self.dropoff, self.diagonaldropoff)
+        if lighting is None:
+            self.baselighting, preprocesslights = level.generate_base_lighting()
+            self.propagate_many(preprocesslights, self.baselighting)
+            if self.use_numpy:
+                self.baselighting = np.array(self.baselighting, dtype=np.int16).clip(0, 255).astype(np.uint8)
+        elif self.use_numpy:
+            self.baselighting = np.frombuffer(lighting, dtype=np.uint8).reshape(self.arrayy, self.arrayx)
+        else:
+            self.baselighting = [list(lighting[i * self.arrayx:(i + 1) * self.arrayx]) for i in range(self.arrayy)]
+        if self.use_numpy:
+            self.transparency_array = np.array(self.transparency_map, dtype=bool)
+            # the whole level shadow map kept by relight(), made on first use
+            self.shadow_array = None
+            # lights currently composed into shadow_array, by (intensity, x, y)
+            self.shadow_lights = Counter()
+
+    def propagate(self, light, array, origin=(0, 0)):
+        """Spreads a light vector3 into adjacent tiles if possible."""
+        self.propagate_many([light], array, origin)
+
+    def propagate_many(self, lights, array, origin=(0, 0)):
+        """Spreads a list of light vector3s through the array in one pass.
+        Tiles are queued in buckets keyed by remaining intensity and the
+        brightest bucket is always drained first, so every tile is expanded
+        at most once no matter how many lights reach it. Produces the same
+        map as flooding each light separately with the dropoff rules.
+        The array may be a window of the level whose top left tile is at
+        origin; light stops at the window edges.
+        """
+        top = 0
+        for light in lights:
+            if light[0] > top:
+                top = light[0]
+        if top <= 0:
             return
-        if light[0] - self.dropoff > 0:
-            if light[1] > 0:
-                self.recurse([light[0] - self.dropoff, light[1] - 1, light[2]], array)
-            if light[1] < self.arrayx - 1:
-                self.recurse([light[0] - self.dropoff, light[1] + 1, light[2]], array)
-            if light[2] > 0:
-                self.recurse([light[0] - self.dropoff, light[1], light[2] - 1], array)
-            if light[2] < self.arrayy - 1:
-                self.recurse([light[0] - self.dropoff, light[1], light[2] + 1], array)
-        if light[0] - self.diagonaldropoff > 0:
-            if light[1] > 0 and light[2] > 0:
-                self.recurse([light[0] - self.diagonaldropoff, light[1] - 1, light[2] - 1], array)
-            if light[1] < self.arrayx - 1 and light[2] < self.arrayy - 1:
-                self.recurse([light[0] - self.diagonaldropoff, light[1] + 1, light[2] + 1], array)
-            if light[1] > 0 and light[2] < self.arrayy - 1:
-                self.recurse([light[0] - self.diagonaldropoff, light[1] - 1, light[2] + 1], array)
-            if light[1] < self.arrayx - 1 and light[2] > 0:
-                self.recurse([light[0] - self.diagonaldropoff, light[1] + 1, light[2] - 1], array)
-        return
+        buckets = [[] for i in range(top + 1)]
+        ox, oy = origin
+        maxx = len(array[0]) - 1
+        maxy = len(array) - 1
+        # only the brightest light on each tile is queued, and neighbours are
+        # only queued when they get brighter, so a tile is never queued twice
+        # at the same intensity
+        seeds = {}
+        for light in lights:
+            x, y = light[1] - ox, light[2] - oy
+            if light[0] > seeds.get((x, y), 0) and 0 <= x <= maxx and 0 <= y <= maxy:
+                seeds[(x, y)] = light[0]
+        for (x, y), intensity in seeds.items():
+            if array[y][x] > intensity:
+                continue
+            array[y][x] = intensity
+            buckets[intensity].append((x, y))
+        dropoff = self.dropoff
+        diagonaldropoff = self.diagonaldropoff
+        transparency_map = self.transparency_map
+        for intensity in range(top, 0, -1):
+            bucket = buckets[intensity]
+            if not bucket:
+                continue
+            straight = intensity - dropoff
+            diagonal = intensity - diagonaldropoff
+            for x, y in bucket:
+                # a brighter light reached this tile after it was queued
+                if array[y][x] != intensity or not transparency_map[y + oy][x + ox]:
+                    continue
+                if straight > 0:
+                    for nx, ny in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                        if 0 <= nx <= maxx and 0 <= ny <= maxy and array[ny][nx] < straight:
+                            array[ny][nx] = straight
+                            buckets[straight].append((nx, ny))
+                if diagonal > 0:
+                    for nx, ny in ((x - 1, y - 1), (x + 1, y + 1), (x - 1, y + 1), (x + 1, y - 1)):
+                        if 0 <= nx <= maxx and 0 <= ny <= maxy and array[ny][nx] < diagonal:
+                            array[ny][nx] = diagonal
+                            buckets[diagonal].append((nx, ny))
+            buckets[intensity] = None
 
-    def generate_shadow_array(self, lightlist) -> "2D Array":
+    def generate_shadow_array(self, lightlist, view=None) -> "2D Array":
         """Pass a list of vector3s in the format
         [lightintensity, lightx, lighty] to
         return a 2d array of alpha values.
+
+        If a (left, top, width, height) view rectangle is passed, only
+        lights that can reach it are evaluated and the returned array
+        covers just the view, with 0 for tiles outside the level.
         """
+        if self.map_version != self.level.version:
+            # the level layout changed, so base lighting and every cached stamp are stale
+            self.set_dimensions(self.level)
+        if view is None and self.level.streaming:
+            view = (0, 0, self.arrayx, self.arrayy)
+        if view is not None:
+            return self.generate_view_array(lightlist, view)
+        if self.use_numpy:
+            return self.relight(lightlist)
         array = [x[:] for x in self.baselighting]
         # copying an array with [:] is significantly faster than copy.deepcopy()
         for light in lightlist:
-            self.recurse(light, array)
-        if self.upscale == True:
-            array = self.upscalearray(array)
+            self.propagate(light, array)
         return array
     
-    def upscalearray(self, array) -> "2D Array":
-        """Upscales a shadowmap array by 3 in each dimension
-        and attempts to smoothen the values by applying
-        bilinear interpolation. This method works fine, in theory,
-        and the rendering is the problem.
+    def generate_view_array(self, lightlist, view) -> "2D Array":
+        """Viewport culled version of generate_shadow_array. The work done
+        depends on the size of the view and the lights near it, never on
+        the size of the level.
+        """
+        left, top, width, height = view
+        right, bottom = left + width, top + height
+        columnstart, columnend = max(left, 0), min(right, self.arrayx)
+        rowstart, rowend = max(top, 0), min(bottom, self.arrayy)
+        visible = []
+        for light in lightlist:
+            if light[0] <= 0:
+                continue
+            footprint = self.light_footprint(light)
+            if footprint[0] < right and footprint[2] > left and footprint[1] < bottom and footprint[3] > top:
+                visible.append(light)
+        if self.use_numpy:
+            # stamps are spread over the level when they are made, so only
+            # the view itself is lit, straight into the returned array
+            output = np.zeros((height, width), dtype=np.uint8)
+            if columnend <= columnstart or rowend <= rowstart:
+                return output
+            clipped = (columnstart, rowstart, columnend, rowend)
+            if self.level.streaming:
+                base = self.level.lighting_window(clipped, self)
+            else:
+                base = self.baselighting[rowstart:rowend, columnstart:columnend]
+            output[rowstart - top:rowend - top, columnstart - left:columnend - left] = base
+            for light in visible:
+                self.compose_light(light, output, clipped, origin=(left, top))
+            return output
+        # propagated light needs the view plus the reach of every visible light
+        windowleft, windowtop, windowright, windowbottom = columnstart, rowstart, columnend, rowend
+        for light in visible:
+            footprint = self.light_footprint(light)
+            windowleft = min(windowleft, footprint[0])
+            windowtop = min(windowtop, footprint[1])
+            windowright = max(windowright, footprint[2])
+            windowbottom = max(windowbottom, footprint[3])
+        origin = (windowleft, windowtop)
+        if self.level.streaming:
+            window = self.level.lighting_window((windowleft, windowtop, windowright, windowbottom), self)
+        else:
+            window = [row[windowleft:windowright] for row in self.baselighting[windowtop:windowbottom]]
+        self.propagate_many(visible, window, origin)
+        output = [[0] * width for i in range(height)]
+        if columnend <= columnstart:
+            return output
+        for i in range(rowstart, rowend):
+            row = window[i - origin[1]][columnstart - origin[0]:columnend - origin[0]]
+            output[i - top][columnstart - left:columnend - left] = row
+        return output
+
+    def relight(self, lightlist) -> "2D Array":
+        """Brings the ndarray shadow map up to date with lightlist and
+        returns it. Only the footprints of lights that appeared or vanished
+        since the last call are touched: tiles under a vanished light are
+        reset to base lighting and relit by every light overlapping them.
+        The returned array is reused between frames and must not be edited.
+        """
+        if self.shadow_array is None:
+            self.shadow_array = self.baselighting.copy()
+        array = self.shadow_array
+        lights = Counter((light[0], light[1], light[2]) for light in lightlist if light[0] > 0)
+        removed = self.shadow_lights - lights
+        added = lights - self.shadow_lights
+        for light in removed:
+            rect = self.light_footprint(light)
+            left, top, right, bottom = rect
+            array[top:bottom, left:right] = self.baselighting[top:bottom, left:right]
+            for other in lights:
+                if other not in added:
+                    self.compose_light(other, array, rect)
+        for light in added:
+            self.compose_light(light, array)
+        self.shadow_lights = lights
+        return array
+
+    def light_footprint(self, light) -> "(left, top, right, bottom)":
+        """Returns the rectangle of tiles a light vector3 can reach,
+        with exclusive right and bottom edges.
+        """
+        intensity, x, y = light[0], light[1], light[2]
+        radius = max(0, (intensity - 1) // self.dropoff)
+        return (max(0, x - radius), max(0, y - radius),
+                min(self.arrayx, x + radius + 1), min(self.arrayy, y + radius + 1))
+
+    def light_stamp(self, light) -> "2D Array, (left, top)":
+        """Returns the area lit by a single light on an unlit map as
+        an int16 ndarray, along with the level position of its top left
+        corner. The stamp only covers the tiles the light can reach.
+        """
+        intensity, x, y = light
+        radius = max(0, (intensity - 1) // self.dropoff)
+        left, top, right, bottom = self.light_footprint(light)
+        transparent = self.transparency_array[top:bottom, left:right]
+        stamp = np.zeros(transparent.shape, dtype=np.int16)
+        stamp[y - top, x - left] = intensity
+        # every step costs at least one dropoff, so radius passes reach the fixed point
+        for i in range(radius):
+            source = np.where(transparent, stamp, 0)
+            straight = source - self.dropoff
+            diagonal = source - self.diagonaldropoff
+            spread = stamp.copy()
+            np.maximum(spread[1:, :], straight[:-1, :], out=spread[1:, :])
+            np.maximum(spread[:-1, :], straight[1:, :], out=spread[:-1, :])
+            np.maximum(spread[:, 1:], straight[:, :-1], out=spread[:, 1:])
+            np.maximum(spread[:, :-1], straight[:, 1:], out=spread[:, :-1])
+            np.maximum(spread[1:, 1:], diagonal[:-1, :-1], out=spread[1:, 1:])
+            np.maximum(spread[:-1, :-1], diagonal[1:, 1:], out=spread[:-1, :-1])
+            np.maximum(spread[1:, :-1], diagonal[:-1, 1:], out=spread[1:, :-1])
+            np.maximum(spread[:-1, 1:], diagonal[1:, :-1], out=spread[:-1, 1:])
+            if np.array_equal(spread, stamp):
+                break
+            stamp = spread
+        return stamp, (left, top)
+
+    def compose_light(self, light, array, rect=None, origin=(0, 0)):
+        """Lights an ndarray shadow map in place by taking the
+        element-wise maximum with the stamp of a light vector3.
+        Pass a (left, top, right, bottom) rect to only touch those tiles,
+        and the level position of the array's top left tile as origin if
+        it is a window of the level.
+        """
+        if light[0] <= 0:
+            return
+        stamp, (left, top) = self.cached_stamp(light)
+        right = left + stamp.shape[1]
+        bottom = top + stamp.shape[0]
+        if rect is not None:
+            cropleft, croptop = max(left, rect[0]), max(top, rect[1])
+            right, bottom = min(right, rect[2]), min(bottom, rect[3])
+            if cropleft >= right or croptop >= bottom:
+                return
+            stamp = stamp[croptop - top:bottom - top, cropleft - left:right - left]
+            left, top = cropleft, croptop
+        region = array[top - origin[1]:bottom - origin[1], left - origin[0]:right - origin[0]]
+        np.maximum(region, stamp, out=region)
+
+    def cached_stamp(self, light) -> "2D Array, (left, top)":
+        """Returns the uint8 stamp of a light vector3, reusing the one
+        propagated last time the same light stood on the same tile.
+        Cached stamps are dropped whenever the level version changes.
+        """
+        key = (light[0], light[1], light[2])
+        cached = self.stamp_cache.get(key)
+        if cached is not None:
+            self.stamp_cache.move_to_end(key)
+            return cached
+        stamp, corner = self.light_stamp(light)
+        cached = (stamp.clip(0, 255).astype(np.uint8), corner)
+        self.stamp_cache[key] = cached
+        if len(self.stamp_cache) > self.stamp_cache_size:
+            self.stamp_cache.popitem(last=False)
+        return cached
+
+    def upscale_array(self, array) -> "2D Array":
+        """Upscales an ndarray shadow map by upscale_factor in each
+        dimension with bilinear interpolation. Each sub-tile samples the
+        map at its own centre, so the middle sub-tile of every tile keeps
+        the tile's value and edges are clamped to the nearest tile.
+        """
+        array = np.asarray(array, dtype=np.float32)
+        rows, rowweights = self.interpolation_weights(array.shape[0])
+        columns, columnweights = self.interpolation_weights(array.shape[1])
+        array = array[rows[0]] * (1 - rowweights[:, None]) + array[rows[1]] * rowweights[:, None]
+        array = array[:, columns[0]] * (1 - columnweights) + array[:, columns[1]] * columnweights
+        return np.rint(array).astype(np.uint8)
+
+    def interpolation_weights(self, length) -> "(low, high), weights":
+        """Returns the pair of source indices and the weight of the higher
+        one for every sub-tile along an axis of the given length.
         """
-        output = [x[:] for x in self.empty_scaled_array]
-        for i in range(self.arrayy):
-            for j in range(self.arrayx):
-                output[i * 3 + 1][j * 3 + 1] = array[i][j]
-        ...
-        for i in range(self.arrayy * 3):
-            for j in range(self.arrayx * 3):
-                if output[i][j] == None:
-                    snapi = rnd(i)
-                    if snapi > self.arrayy * 3:
-                        snapi -= 3
-                    elif snapi < 0:
-                        snapi += 3
-                    remj = j % 3
-                    if 1 < j < self.arrayx * 3 - 2:
-                        if remj == 0:
-                            output[i][j] = int((output[snapi][j + 1] * 2 + output[snapi][j - 2]) / 3)
-                        elif remj == 1:
-                            output[i][j] = output[snapi][j]
-                        elif remj == 2:
-                            output[i][j] = int((output[snapi][j - 1] * 2 + output[snapi][j + 2]) / 3)
-        return output
\ No newline at end of file
+        factor = self.upscale_factor
+        if (length, factor) not in self.upscale_weights:
+            centres = (np.arange(length * factor) + 0.5) / factor - 0.5
+            centres = centres.clip(0, length - 1)
+            low = np.floor(centres).astype(np.intp)
+            high = np.minimum(low + 1, length - 1)
+            self.upscale_weights[length, factor] = ((low, high), (centres - low).astype(np.float32))
+        return self.upscale_weights[length, factor]
@@ -1,4 +1,5 @@
 import pygame as pg
+import utils
 class UserInterface():
     """Child Class of Game, represents the UI for a specific level.
     Uses data from game.player to add stats and items.
@@ -7,11 +8,11 @@ class UserInterface():
         self.width = assets.resolutionx
         self.height = 192
         self.vert_location = assets.resolutiony - self.height
-        self.sprite = pg.image.load("sprites/uimenu.png")
+        self.sprite = utils.spritecache.load("sprites/uimenu.png")
         # todo - transform sprites here for optimization
-        sp1 = pg.image.load("sprites/goldheart.png")
-        sp2 = pg.image.load("sprites/heart.png")
-        sp3 = pg.image.load("sprites/heartbroken.png")
+        sp1 = utils.spritecache.load("sprites/goldheart.png")
+        sp2 = utils.spritecache.load("sprites/heart.png")
+        sp3 = utils.spritecache.load("sprites/heartbroken.png")
         self.heartsprites = [sp1, sp2, sp3]
         self.max_health = player.max_health
         self.max_hearts = int(self.width / 140)
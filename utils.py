@@ -1,6 +1,12 @@
 import os
 import pygame
-pygame.display.set_mode((600, 600))
+import atlas
+
+# sprite directories that are packed into a shared atlas when scaled
+ATLASGROUPS = {
+    "tiles": ["./sprites/Grass/", "./sprites/Wall/", "./sprites/player/", "./sprites/arrows/", "./sprites/fireball/"],
+    "inventory": ["./sprites/inventory/"],
+}
 def make_dict(directory):
     """Creates a dictionary of pygame image object of ALL files in a
     directory. To use current script directory, use ./{dir}/{dir}/
@@ -13,3 +19,75 @@ def make_dict(directory):
         except:
             pass
     return dictionary
+
+class SpriteCache():
+    """Shared store for every sprite in the game. Nothing is loaded until it
+    is first asked for, which must happen after the display mode is set.
+    Each image or directory is read from disk once, and scaled or otherwise derived variants are
+    built once per size and handed out as shared references, so sprites
+    from the cache must be copied before anything is drawn onto them.
+    """
+    def __init__(self):
+        self.images = {}
+        self.directories = {}
+        self.variants = {}
+
+    def load(self, path) -> "Surface":
+        """Returns the image at path, loading it on first use."""
+        if path not in self.images:
+            self.images[path] = pygame.image.load(path).convert_alpha()
+        return self.images[path]
+
+    def load_directory(self, directory) -> "Dictionary":
+        """Returns the shared dictionary of the images in a directory as
+        make_dict() would build it, loading the directory on first use.
+        Copy the dictionary before adding or replacing entries.
+        """
+        if directory not in self.directories:
+            self.directories[directory] = make_dict(directory)
+        return self.directories[directory]
+
+    def scaled(self, path, size) -> "Surface":
+        """Returns the image at path scaled to size, which is either a
+        (width, height) tuple or a single side length for square sprites.
+        """
+        if isinstance(size, int):
+            size = (size, size)
+        return self.variant(("scaled", path, size), lambda: pygame.transform.scale(self.load(path), size))
+
+    def scaled_directory(self, directory, size) -> "Dictionary":
+        """Returns the shared dictionary of every image in a directory scaled
+        to size. Directories in ATLASGROUPS are handed out as subsurfaces of
+        atlas pages, so drawing onto one of their sprites without copying it
+        first would also draw onto its neighbours.
+        """
+        if isinstance(size, int):
+            size = (size, size)
+        def build():
+            for group, directories in ATLASGROUPS.items():
+                if directory in directories:
+                    return self.atlas(group, size).directory(directory)
+            return {key: pygame.transform.scale(sprite, size) for key, sprite in self.load_directory(directory).items()}
+        return self.variant(("scaled directory", directory, size), build)
+
+    def atlas(self, group, size) -> "Atlas":
+        """Returns the atlas of every directory in an atlas group scaled to
+        size, loading it from the disk cache or building it on first use.
+        """
+        def build():
+            packed = atlas.Atlas(group, ATLASGROUPS[group], size)
+            if not packed.load():
+                packed.build(self)
+                packed.save()
+            return packed
+        return self.variant(("atlas", group, size), build)
+
+    def variant(self, key, build):
+        """Returns the variant stored under key, calling build() to
+        create it the first time it is asked for.
+        """
+        if key not in self.variants:
+            self.variants[key] = build()
+        return self.variants[key]
+
+spritecache = SpriteCache()
@@ -0,0 +1,104 @@
+"""Integer line of sight and field of view over a level's transparency_map.
+
+FieldOfView uses symmetric shadowcasting, so a tile is visible from the
+origin exactly when the origin is visible from that tile, and every slope
+is kept as an exact fraction of two integers. The player's field of view
+is computed once per turn and entities check whether they can see the
+player by looking themselves up in it.
+"""
+
+# the (dx, dy) offset of a (depth, column) tile in each quadrant is
+# (depth * a + column * b, depth * c + column * d) for its (a, b, c, d),
+# in the order north, east, south and west
+QUADRANTS = [(0, 1, -1, 0), (1, 0, 0, 1), (0, 1, 1, 0), (-1, 0, 0, 1)]
+
+def line(start, end) -> "List":
+    """Returns the tiles on the Bresenham line from start to end, both included."""
+    x, y = start
+    dx, dy = abs(end[0] - x), -abs(end[1] - y)
+    stepx = 1 if end[0] > x else -1
+    stepy = 1 if end[1] > y else -1
+    error = dx + dy
+    tiles = [(x, y)]
+    while (x, y) != tuple(end):
+        double = 2 * error
+        if double >= dy:
+            error += dy
+            x += stepx
+        if double <= dx:
+            error += dx
+            y += stepy
+        tiles.append((x, y))
+    return tiles
+
+def round_up(depth, numerator, denominator) -> "Integer":
+    """depth * numerator / denominator rounded to the nearest integer, with halves rounded up."""
+    return (2 * depth * numerator + denominator) // (2 * denominator)
+
+def round_down(depth, numerator, denominator) -> "Integer":
+    """depth * numerator / denominator rounded to the nearest integer, with halves rounded down."""
+    return -((denominator - 2 * depth * numerator) // (2 * denominator))
+
+class FieldOfView():
+    """The set of tiles visible from an origin within radius tiles of it,
+    given the [y][x] transparency of each tile of a width by height level.
+    Tiles outside the level are opaque. Without a radius the whole level
+    is in range, like a line of sight check between any two tiles.
+    """
+    def __init__(self, transparency, width, height, origin, radius=None):
+        self.origin = tuple(origin)
+        self.radius = radius if radius is not None else max(width, height)
+        self.visible = {self.origin}
+        self.transparency = transparency
+        self.width = width
+        self.height = height
+        for quadrant in QUADRANTS:
+            self.cast(quadrant)
+
+    def opaque(self, position) -> "Boolean":
+        x, y = position
+        return not (0 <= x < self.width and 0 <= y < self.height) or not self.transparency[y][x]
+
+    def cast(self, quadrant):
+        """Scans one quadrant row by row, keeping the rows still to scan on
+        a stack as (depth, start slope, end slope), with every slope held as
+        a (numerator, denominator) pair.
+        """
+        originx, originy = self.origin
+        a, b, c, d = quadrant
+        rows = [(1, (-1, 1), (1, 1))]
+        while rows:
+            depth, start, end = rows.pop()
+            if depth > self.radius:
+                continue
+            previous = None
+            for column in range(round_up(depth, *start), round_down(depth, *end) + 1):
+                tile = (originx + depth * a + column * b, originy + depth * c + column * d)
+                wall = self.opaque(tile)
+                # floors are only visible if they are centred within the
+                # slopes, which is what makes the field of view symmetric
+                if wall or (column * start[1] >= depth * start[0] and column * end[1] <= depth * end[0]):
+                    if 0 <= tile[0] < self.width and 0 <= tile[1] < self.height:
+                        self.visible.add(tile)
+                if previous is True and not wall:
+                    start = (2 * column - 1, 2 * depth)
+                if previous is False and wall:
+                    rows.append((depth + 1, start, (2 * column - 1, 2 * depth)))
+                previous = wall
+            if previous is False:
+                rows.append((depth + 1, start, end))
+
+    def sees(self, position) -> "Boolean":
+        """Checks whether the tile at an (x, y) position is visible."""
+        return tuple(position) in self.visible
+
+    def mask(self, rect) -> "Bytearray":
+        """Returns the visibility of the tiles in a (left, top, width, height)
+        rect row by row, one byte per tile that is 1 if it is visible.
+        """
+        left, top, width, height = rect
+        mask = bytearray(width * height)
+        for x, y in self.visible:
+            if left <= x < left + width and top <= y < top + height:
+                mask[(y - top) * width + x - left] = 1
+        return mask